@@ -6,13 +6,39 @@ def create_app(configuration=Config):
     app = Flask(__name__)
 
     from app.models import db, login_manager, migrate
+    from app.replicas import replica_routing
+    from app.engines import engine_profiles
 
     app.config.from_object(configuration)
+    # report workers run in their own processes, and build their app from the same configuration
+    app.config["CONFIG_OBJECT"] = (
+        configuration
+        if isinstance(configuration, str)
+        else f"{configuration.__module__}.{configuration.__qualname__}"
+    )
+    replica_routing.init_app(app)
+    engine_profiles.init_app(app)
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
     login_manager.login_view = "route_blueprint.login"
 
+    from app.instrumentation import query_instrumentation
+
+    query_instrumentation.init_app(app)
+
+    from app.lookups import lookups
+
+    lookups.init_app(app)
+
+    from reporting.cache import report_cache
+
+    report_cache.init_app(app)
+
+    from reporting.jobs import report_jobs
+
+    report_jobs.init_app(app)
+
     from app.routes import route_blueprint
 
     app.register_blueprint(route_blueprint)
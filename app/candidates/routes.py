@@ -1,11 +1,41 @@
 from app.models import *
 from app.candidates import candidates_bp
-from flask import render_template, abort
+from app.loading import loader_profile
+from app.replicas import replica_routing
+from app.search import search
+from flask import current_app, jsonify, render_template, request, abort, url_for
 
 
 @candidates_bp.route("/candidate/<int:candidate_id>", methods=["POST", "GET"])
+@replica_routing.read_only
 def candidate_profile(candidate_id):
-    candidate = Candidate.query.get(candidate_id)
+    candidate = Candidate.query.options(*loader_profile("profile")).get(candidate_id)
     if not candidate:
         return abort(404)
-    return render_template("candidates/profile.html", candidate=candidate)
+    return render_template(
+        "candidates/profile.html",
+        candidate=candidate,
+        current=Candidate.current_state_for([candidate.id]).get(candidate.id),
+    )
+
+
+@candidates_bp.route("/search")
+@replica_routing.read_only
+def typeahead():
+    """
+    Up to `limit` candidates, and no more than SEARCH_MAX_RESULTS, matching the first few characters of a name, email
+    address, employee number or PER id in `q`
+    """
+    limit = min(
+        request.args.get("limit", 10, type=int),
+        current_app.config["SEARCH_MAX_RESULTS"],
+    )
+    return jsonify(
+        candidates=[
+            {
+                **result._asdict(),
+                "url": url_for(".candidate_profile", candidate_id=result.candidate_id),
+            }
+            for result in search(request.args.get("q", ""), max(limit, 1))
+        ]
+    )
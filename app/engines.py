@@ -0,0 +1,281 @@
+"""
+Named engine profiles, so that interactive requests and long reports don't share one pool. Each profile in
+SQLALCHEMY_ENGINE_PROFILES has its own pool size, overflow, checkout timeout, recycle time, pre-ping and statement
+timeout:
+
+- "interactive" configures the engines Flask-SQLAlchemy creates, for the primary and the replica
+- any other profile, such as "reporting" or "maintenance", gets engines of its own, used by the session inside
+  `engine_profiles.workload(name)`. A workload with no profile uses the interactive engines
+
+A statement that runs for longer than its profile's `statement_timeout` seconds is cancelled: Postgres does this itself,
+and on SQLite a progress handler interrupts it. Either way the caller gets an OperationalError. SQLite works out most
+of a result's rows as they're fetched, so there the clock keeps running while rows are read, until the next statement
+starts or the transaction ends.
+
+Each profile's pools count their checkouts, how long each one waited and how many connections are in use, which
+`engine_profiles.metrics()` reports.
+"""
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from flask import current_app
+from flask_sqlalchemy import get_state
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
+
+INTERACTIVE = "interactive"
+
+# the options only a QueuePool takes
+QUEUE_OPTIONS = ("pool_size", "max_overflow", "pool_timeout")
+
+
+class PoolMetrics:
+    """
+    Checkouts from every pool created for one profile: how many there have been, how long they waited for a
+    connection, and how many connections are checked out now and at most
+    """
+
+    def __init__(self, capacity: Optional[int]):
+        # connections each pool can hand out at once, or None if there's no limit
+        self.capacity = capacity
+        self.pools = weakref.WeakSet()
+        self.checkouts = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def waited(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def checked_out_one(self) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def checked_in_one(self) -> None:
+        with self._lock:
+            self.checked_out -= 1
+
+    def as_dict(self) -> Dict:
+        capacity = self.capacity * len(self.pools) if self.capacity else None
+        return {
+            "checkouts": self.checkouts,
+            "checked_out": self.checked_out,
+            "peak_checked_out": self.peak_checked_out,
+            "capacity": capacity,
+            "utilisation": round(self.checked_out / capacity, 3) if capacity else None,
+            "timeouts": self.timeouts,
+            "mean_wait_ms": round(self.total_wait * 1000 / self.checkouts, 2)
+            if self.checkouts
+            else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+
+
+def measured_pool(pool_class, settings: Dict, metrics: PoolMetrics):
+    """
+    A subclass of `pool_class` that records its checkouts in `metrics` and gives its connections the statement timeout
+    in `settings`. Everything is kept on the class, so the pool an engine recreates after `dispose()` is measured too
+    """
+
+    class MeasuredPool(pool_class):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            metrics.pools.add(self)
+
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except exc.TimeoutError:
+                metrics.waited(time.perf_counter() - start, timed_out=True)
+                raise
+            metrics.waited(time.perf_counter() - start)
+            return connection
+
+    MeasuredPool.__name__ = f"Measured{pool_class.__name__}"
+    event.listen(MeasuredPool, "checkout", lambda *args: metrics.checked_out_one())
+    event.listen(MeasuredPool, "checkin", lambda *args: metrics.checked_in_one())
+
+    timeout = settings.get("statement_timeout")
+    if timeout:
+
+        @event.listens_for(MeasuredPool, "connect")
+        def limit_statements(dbapi_connection, connection_record):
+            connection_record.info["statement_timeout"] = timeout
+            if hasattr(dbapi_connection, "set_progress_handler"):
+                deadline = connection_record.info["statement_deadline"] = [None]
+                dbapi_connection.set_progress_handler(
+                    lambda: deadline[0] is not None and time.monotonic() > deadline[0],
+                    1000,
+                )
+
+        @event.listens_for(MeasuredPool, "reset")
+        def stop_clock_on_reset(dbapi_connection, connection_record):
+            # the pool rolls the connection back as it's returned, which mustn't be interrupted
+            stop_statement_clock(connection_record.info)
+
+    return MeasuredPool
+
+
+def engine_options(uri: str, settings: Dict, metrics: PoolMetrics) -> Dict:
+    """
+    The create_engine options for a profile's `settings` on the database at `uri`. SQLite is connected to afresh each
+    time, or through one shared connection when it's in memory, so the queue settings only apply to other databases
+    """
+    url = make_url(uri)
+    # the dialect's name, because heroku style postgres:// URLs don't name the postgresql backend
+    dialect = url.get_dialect().name
+    if dialect == "sqlite":
+        pool_class = StaticPool if url.database in (None, "", ":memory:") else NullPool
+    else:
+        pool_class = QueuePool
+    options = {
+        "poolclass": measured_pool(pool_class, settings, metrics),
+        "pool_recycle": settings.get("pool_recycle", -1),
+        "pool_pre_ping": settings.get("pool_pre_ping", False),
+    }
+    if pool_class is QueuePool:
+        options.update(
+            (option, settings[option]) for option in QUEUE_OPTIONS if option in settings
+        )
+    if dialect == "postgresql" and settings.get("statement_timeout"):
+        milliseconds = int(settings["statement_timeout"] * 1000)
+        options["connect_args"] = {"options": f"-c statement_timeout={milliseconds}"}
+    return options
+
+
+def pool_capacity(uri: str, settings: Dict) -> Optional[int]:
+    if make_url(uri).get_dialect().name == "sqlite":
+        return None
+    return settings.get("pool_size", 5) + settings.get("max_overflow", 10)
+
+
+def stop_statement_clock(info: Dict) -> None:
+    if "statement_deadline" in info:
+        info["statement_deadline"][0] = None
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement_clock(conn, cursor, statement, parameters, context, executemany):
+    """
+    The clock isn't stopped once the statement returns its first row, because SQLite computes the rest as they're
+    fetched, which for a streamed report goes on long afterwards. The next statement restarts it
+    """
+    info = conn.connection.info
+    if "statement_deadline" in info:
+        info["statement_deadline"][0] = time.monotonic() + info["statement_timeout"]
+
+
+@event.listens_for(Engine, "commit")
+@event.listens_for(Engine, "rollback")
+def stop_statement_clock_at_transaction_end(conn):
+    # so that a transaction committed some time after its last statement isn't interrupted
+    if not conn.invalidated:
+        stop_statement_clock(conn.connection.info)
+
+
+class EngineProfiles:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Must run before `db.init_app`, so that the interactive profile's options are in place before Flask-SQLAlchemy
+        reads them
+        """
+        app.config.setdefault("SQLALCHEMY_ENGINE_PROFILES", {})
+        profiles = app.config["SQLALCHEMY_ENGINE_PROFILES"]
+        uri = app.config.get("SQLALCHEMY_DATABASE_URI") or "sqlite://"
+        state = app.extensions["engine_profiles"] = {
+            "metrics": {
+                name: PoolMetrics(pool_capacity(uri, settings))
+                for name, settings in profiles.items()
+            },
+            "engines": {},
+            "lock": threading.Lock(),
+        }
+        if INTERACTIVE in profiles:
+            app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+                **engine_options(
+                    uri, profiles[INTERACTIVE], state["metrics"][INTERACTIVE]
+                ),
+                **(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {}),
+            }
+
+    @staticmethod
+    def has_engine(app, profile: Optional[str]) -> bool:
+        return profile not in (None, INTERACTIVE) and profile in (
+            app.config.get("SQLALCHEMY_ENGINE_PROFILES") or {}
+        )
+
+    @staticmethod
+    def engine(app, profile: str, bind: Optional[str] = None) -> Engine:
+        """
+        The engine for `profile` on the primary, or on `bind` such as the replica. It's created on first use
+        """
+        state = app.extensions["engine_profiles"]
+        with state["lock"]:
+            if (profile, bind) not in state["engines"]:
+                if bind is None:
+                    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+                else:
+                    uri = app.config["SQLALCHEMY_BINDS"][bind]
+                url = make_url(uri)
+                options = {}
+                db = get_state(app).db
+                db.apply_driver_hacks(app, url, options)
+                options.update(
+                    engine_options(
+                        uri,
+                        app.config["SQLALCHEMY_ENGINE_PROFILES"][profile],
+                        state["metrics"][profile],
+                    )
+                )
+                state["engines"][(profile, bind)] = db.create_engine(url, options)
+            return state["engines"][(profile, bind)]
+
+    @contextmanager
+    def workload(self, profile: str):
+        """
+        Use `profile`'s engines for the session's reads and writes until the block ends. The session's transaction is
+        ended afterwards so its connection goes back to the profile's pool, unless something was written, which is
+        left for the caller to commit
+        """
+        session = get_state(current_app).db.session()
+        if not self.has_engine(current_app, profile):
+            yield
+            return
+        previous = session.info.get("engine_profile")
+        session.info["engine_profile"] = profile
+        try:
+            yield
+        finally:
+            session.info["engine_profile"] = previous
+            if not session.info.get("written"):
+                session.rollback()
+
+    @staticmethod
+    def metrics(app=None) -> Dict[str, Dict]:
+        app = app or current_app
+        return {
+            name: metrics.as_dict()
+            for name, metrics in app.extensions["engine_profiles"]["metrics"].items()
+        }
+
+
+engine_profiles = EngineProfiles()
@@ -0,0 +1,168 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Each thread has a stack of recorders, so that a test can count the queries of one report inside a request that's
+# already being counted
+_local = threading.local()
+
+
+class QueryStats:
+    """
+    The statements run while this recorder was active: how many, how long they took between them, and the slowest
+    """
+
+    def __init__(self, keep_statements: bool = False):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.statements: List[Tuple[str, float]] = [] if keep_statements else None
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.total_time += duration
+        if duration >= self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+        if self.statements is not None:
+            self.statements.append((statement, duration))
+
+    def __enter__(self):
+        _recorders().append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _recorders().remove(self)
+
+
+def _recorders() -> List[QueryStats]:
+    if not hasattr(_local, "recorders"):
+        _local.recorders = []
+    return _local.recorders
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if _recorders():
+        conn.info["query_start_time"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    # taken off the connection even if the recorder has finished since, so no later statement can pair with it
+    start_time = conn.info.pop("query_start_time", None)
+    if start_time is None:
+        return
+    duration = time.perf_counter() - start_time
+    for recorder in _recorders():
+        recorder.record(statement, duration)
+
+
+@event.listens_for(Engine, "handle_error")
+def forget_failed_query(context):
+    """
+    A statement that raises never reaches after_cursor_execute, so its start time is dropped here rather than left on
+    the pooled connection for the next statement to be timed from
+    """
+    if context.connection is not None:
+        context.connection.info.pop("query_start_time", None)
+
+
+class QueryInstrumentation:
+    """
+    Counts the SQL statements each request issues. The count and the time spent in the database go in the response's
+    X-Query-Count, X-Query-Time and Server-Timing headers, and when the request ends a JSON line with the slowest
+    statement is logged to the app's "queries" logger at SQL_INSTRUMENTATION_LOG_LEVEL. Switch it off with
+    SQL_INSTRUMENTATION = False
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SQL_INSTRUMENTATION", True)
+        app.config.setdefault("SQL_INSTRUMENTATION_LOG_LEVEL", "INFO")
+        if not app.config["SQL_INSTRUMENTATION"]:
+            return
+        # app.logger only passes on warnings unless the app is in debug mode, so the log line has a logger of its own
+        self.logger(app).setLevel(app.config["SQL_INSTRUMENTATION_LOG_LEVEL"])
+        app.before_request(self.start)
+        app.after_request(self.add_headers)
+        app.teardown_request(self.finish)
+
+    @staticmethod
+    def logger(app) -> logging.Logger:
+        return app.logger.getChild("queries")
+
+    @staticmethod
+    def start():
+        g.query_stats = QueryStats().__enter__()
+
+    @staticmethod
+    def add_headers(response):
+        stats = g.get("query_stats")
+        if stats is not None:
+            milliseconds = stats.total_time * 1000
+            response.headers["X-Query-Count"] = str(stats.count)
+            response.headers["X-Query-Time"] = f"{milliseconds:.2f}"
+            response.headers[
+                "Server-Timing"
+            ] = f'db;dur={milliseconds:.2f};desc="{stats.count} queries"'
+        return response
+
+    @classmethod
+    def finish(cls, exception=None):
+        """
+        Runs once the response has been sent, so queries made while streaming a response are counted in the log line
+        even though they arrived too late for the headers
+        """
+        stats = g.pop("query_stats", None)
+        if stats is None:
+            return
+        stats.__exit__()
+        cls.logger(current_app).info(
+            json.dumps(
+                {
+                    "event": "request_queries",
+                    "method": request.method,
+                    "path": request.path,
+                    "endpoint": request.endpoint,
+                    "query_count": stats.count,
+                    "query_time_ms": round(stats.total_time * 1000, 2),
+                    "slowest_query_ms": round(stats.slowest_time * 1000, 2),
+                    "slowest_query": stats.slowest_statement,
+                }
+            )
+        )
+
+
+query_instrumentation = QueryInstrumentation()
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """
+    Fail if the code in the block runs more than `limit` SQL statements. The statements are listed in the failure
+
+        with assert_max_queries(5):
+            report.get_data()
+    """
+    with QueryStats(keep_statements=True) as stats:
+        yield stats
+    if stats.count > limit:
+        statements = "\n".join(
+            f"{number}. {statement}"
+            for number, (statement, _) in enumerate(stats.statements, start=1)
+        )
+        raise AssertionError(
+            f"Expected at most {limit} queries but {stats.count} were run:\n{statements}"
+        )
@@ -0,0 +1,87 @@
+"""
+Named sets of loader options, so that each view or report can load the relationships it's about to use up front instead
+of lazily, one row at a time:
+
+    Candidate.query.options(*loader_profile("listing")).all()
+
+Collections are loaded through `Candidate.role_history` and `Candidate.application_history`, with one extra query per
+collection, and the many-to-one relationships of each role with joins
+"""
+from typing import List
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from app.models import Candidate, Role
+
+
+def characteristics(*names: str) -> List:
+    return [joinedload(getattr(Candidate, name)) for name in names]
+
+
+def role_history(*relationships: str) -> List:
+    return [
+        selectinload(Candidate.role_history).joinedload(getattr(Role, relationship))
+        for relationship in relationships
+    ]
+
+
+def profile() -> List:
+    """
+    A candidate's profile page, with every role they've held
+    """
+    return [
+        *characteristics("ethnicity"),
+        *role_history("grade", "location", "profession", "role_change"),
+    ]
+
+
+def listing() -> List:
+    """
+    Lists of candidates, with the organisation of each of their roles
+    """
+    return role_history("organisation")
+
+
+def detailed_report() -> List:
+    """
+    A row per candidate with every characteristic. Only many-to-one relationships are joined, so the query can be
+    streamed with yield_per
+    """
+    return characteristics(
+        "ethnicity",
+        "gender",
+        "sexuality",
+        "age_range",
+        "belief",
+        "working_pattern",
+        "main_job_type",
+        "joining_grade",
+    )
+
+
+def promotion_report() -> List:
+    """
+    The per-candidate promotion reports, which look at each candidate's ethnicity and latest application
+    """
+    return [*characteristics("ethnicity"), selectinload(Candidate.application_history)]
+
+
+# built when they're asked for, since some relationships, like Role.organisation, only exist once the mappers have
+# been configured
+LOADER_PROFILES = {
+    "profile": profile,
+    "listing": listing,
+    "detailed_report": detailed_report,
+    "promotion_report": promotion_report,
+}
+
+
+def loader_profile(name: str) -> List:
+    """
+    The loader options for the profile called `name`, to pass to `Query.options`
+    """
+    try:
+        build = LOADER_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"No such loader profile: {name}")
+    return build()
@@ -0,0 +1,165 @@
+import time
+from collections import namedtuple
+from itertools import chain
+from threading import Lock
+from types import MappingProxyType
+from typing import Dict, Iterator, Optional, Tuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models import (
+    db,
+    Promotion,
+    Grade,
+    Scheme,
+    Organisation,
+    Location,
+    Profession,
+    Ethnicity,
+    Gender,
+    Sexuality,
+    Belief,
+    AgeRange,
+    WorkingPattern,
+    MainJobType,
+)
+
+
+class LookupTable:
+    """
+    An immutable copy of one reference table. Rows are namedtuples with the same attributes as the model, ordered by
+    id, and can be found by id or by their `value` (or `name`, for tables that have one of those instead)
+    """
+
+    def __init__(self, model, label_column: str):
+        columns = [column.key for column in model.__mapper__.column_attrs]
+        record = namedtuple(f"{model.__name__}Row", columns)
+        self.rows: Tuple = tuple(
+            record(*row)
+            for row in db.session.query(
+                *[getattr(model, column) for column in columns]
+            ).order_by(model.id)
+        )
+        self._by_id = MappingProxyType({row.id: row for row in self.rows})
+        self._by_label = MappingProxyType(
+            {getattr(row, label_column): row for row in self.rows}
+        )
+        self.loaded_at = time.monotonic()
+
+    def __iter__(self) -> Iterator:
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get(self, row_id):
+        try:
+            return self._by_id.get(int(row_id))
+        except (TypeError, ValueError):
+            return None
+
+    def find(self, label: str):
+        return self._by_label.get(label)
+
+    def containing(self, fragment: str):
+        """
+        The first row whose label contains `fragment`, like `Promotion.value.like("%fragment%")`
+        """
+        return next(
+            (row for label, row in self._by_label.items() if fragment in label), None
+        )
+
+
+class Lookups:
+    """
+    Reference tables, such as Promotion, Grade and Scheme, loaded once per process and kept until they're written to.
+    Writes made through the session invalidate the tables they touch as soon as they're flushed; LOOKUP_TTL bounds how
+    long another process's writes can go unseen
+    """
+
+    tables: Dict = {
+        Promotion: "value",
+        Grade: "value",
+        Scheme: "name",
+        Organisation: "name",
+        Location: "value",
+        Profession: "value",
+        Ethnicity: "value",
+        Gender: "value",
+        Sexuality: "value",
+        Belief: "value",
+        AgeRange: "value",
+        WorkingPattern: "value",
+        MainJobType: "value",
+    }
+
+    def __init__(self, app=None):
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("LOOKUP_TTL", 300)
+        app.extensions["lookups"] = {}
+
+    @property
+    def _loaded(self) -> Dict:
+        return current_app.extensions["lookups"]
+
+    def table(self, model) -> LookupTable:
+        if model not in self.tables:
+            raise KeyError(f"{model.__name__} isn't a lookup table")
+        table: Optional[LookupTable] = self._loaded.get(model)
+        ttl = current_app.config["LOOKUP_TTL"]
+        if table is None or (ttl and time.monotonic() - table.loaded_at > ttl):
+            with self._lock:
+                table = LookupTable(model, self.tables[model])
+                self._loaded[model] = table
+        return table
+
+    def invalidate(self, *models) -> None:
+        if not has_app_context():
+            return
+        for model in models or list(self._loaded):
+            self._loaded.pop(model, None)
+
+
+lookups = Lookups()
+
+
+def _lookup_models(instances):
+    return {
+        type(instance) for instance in instances if type(instance) in Lookups.tables
+    }
+
+
+@event.listens_for(Session, "after_flush")
+def invalidate_flushed_lookups(session, flush_context):
+    """
+    Dropped straight away, so the rest of the transaction sees its own writes, and again when it ends, in case a
+    table was reloaded with writes that were then rolled back
+    """
+    changed = _lookup_models(chain(session.new, session.dirty, session.deleted))
+    if changed:
+        lookups.invalidate(*changed)
+        session.info.setdefault("changed_lookups", set()).update(changed)
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def invalidate_bulk_lookups(context):
+    if context.mapper.class_ in Lookups.tables:
+        lookups.invalidate(context.mapper.class_)
+        context.session.info.setdefault("changed_lookups", set()).add(
+            context.mapper.class_
+        )
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def invalidate_changed_lookups(session):
+    changed = session.info.pop("changed_lookups", None)
+    if changed:
+        lookups.invalidate(*changed)
@@ -1,14 +1,30 @@
-from flask_sqlalchemy import SQLAlchemy
+from app.replicas import RoutingSQLAlchemy
 from werkzeug.security import check_password_hash, generate_password_hash
 from flask_login import UserMixin
 from flask_migrate import Migrate
 from flask_login import LoginManager
+from collections import defaultdict, namedtuple
 from datetime import datetime
-from sqlalchemy import and_, func
+from itertools import chain
+from typing import Dict, Iterable, List, Set
+from sqlalchemy import (
+    Integer,
+    and_,
+    case,
+    cast,
+    event,
+    exists,
+    extract,
+    func,
+    inspect,
+    or_,
+    select,
+)
 from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.orm import Session, validates
 
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 login_manager = LoginManager()
 
@@ -54,6 +70,11 @@ class Ethnicity(CandidateGetterMixin, db.Model):
     bame = db.Column(db.Boolean)
 
 
+CurrentState = namedtuple(
+    "CurrentState", ["role", "grade", "location", "organisation", "application"]
+)
+
+
 class Candidate(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     joining_date = db.Column(db.Date())
@@ -77,14 +98,51 @@ class Candidate(db.Model):
     main_job_type_id = db.Column(db.ForeignKey("main_job_type.id"))
     joining_grade_id = db.Column(db.ForeignKey("grade.id"))
 
+    # the latest role and application, kept up to date by `refresh_current_pointers` below
+    current_role_id = db.Column(
+        db.ForeignKey(
+            "role.id",
+            name="fk_candidate_current_role_id_role",
+            use_alter=True,
+            ondelete="SET NULL",
+        )
+    )
+    current_application_id = db.Column(
+        db.ForeignKey(
+            "application.id",
+            name="fk_candidate_current_application_id_application",
+            use_alter=True,
+            ondelete="SET NULL",
+        )
+    )
+
     roles = db.relationship(
-        "Role", backref="candidate", lazy="dynamic", order_by="Role.date_started.desc()"
+        "Role",
+        backref="candidate",
+        lazy="dynamic",
+        order_by="Role.date_started.desc()",
+        foreign_keys="Role.candidate_id",
     )
     applications = db.relationship(
         "Application",
         backref="candidate",
         lazy="dynamic",
         order_by="Application.scheme_start_date.desc()",
+        foreign_keys="Application.candidate_id",
+    )
+    # read-only lists of the same roles and applications, which unlike the dynamic relationships above can be eager
+    # loaded. See the loader profiles in app.loading
+    role_history = db.relationship(
+        "Role",
+        viewonly=True,
+        order_by="Role.date_started.desc()",
+        foreign_keys="Role.candidate_id",
+    )
+    application_history = db.relationship(
+        "Application",
+        viewonly=True,
+        order_by="Application.scheme_start_date.desc()",
+        foreign_keys="Application.candidate_id",
     )
     joining_grade = db.relationship("Grade", backref="candidate")
 
@@ -92,7 +150,12 @@ class Candidate(db.Model):
         return f"<Candidate email {self.email_address}>"
 
     def current_grade(self) -> "Grade":
-        return self.roles.order_by(Role.date_started.desc()).first().grade
+        return (
+            Grade.query.join(Role, Role.grade_id == Grade.id)
+            .join(Candidate, Candidate.current_role_id == Role.id)
+            .filter(Candidate.id == self.id)
+            .first()
+        )
 
     def promoted(
         self,
@@ -110,44 +173,237 @@ class Candidate(db.Model):
         :return:
         :rtype:
         """
-        if temporary:
-            role_change = Promotion.query.filter(
-                Promotion.value.like("%temporary%")
-            ).first()
-        else:
-            role_change = Promotion.query.filter(
-                Promotion.value.like("%substantive%")
-            ).first()
-        if not promoted_before_date:
-            promoted_before_date = datetime.today()
         roles_after_date = self.roles.filter(
-            and_(
-                Role.date_started >= promoted_after_date,
-                Role.date_started <= promoted_before_date,
-                Role.role_change == role_change,
+            self.promotion_criteria(
+                promoted_after_date, promoted_before_date, temporary
             )
         ).all()
         return len(roles_after_date) > 0
 
+    @staticmethod
+    def promotion_criteria(
+        promoted_after_date: datetime.date, promoted_before_date=None, temporary=False
+    ):
+        """
+        The filter on Role that `promoted` applies to a single candidate's roles. It's exposed so that reports can ask
+        the same question of many candidates at once, for example inside an EXISTS clause
+        :param promoted_after_date:
+        :type promoted_after_date:
+        :param promoted_before_date: defaults to today
+        :param temporary: Whether the user wants temporary or substantive promotions
+        :type temporary: bool
+        :return: a SQL expression
+        """
+        from app.lookups import lookups
+
+        role_change = lookups.table(Promotion).containing(
+            "temporary" if temporary else "substantive"
+        )
+        if not promoted_before_date:
+            promoted_before_date = datetime.today()
+        return and_(
+            Role.date_started >= promoted_after_date,
+            Role.date_started <= promoted_before_date,
+            Role.role_change_id == (role_change.id if role_change else None),
+        )
+
     def current_scheme(self) -> "Scheme":
-        return Scheme.query.get(
-            self.applications.order_by(Application.application_date.desc())
+        return (
+            Scheme.query.join(Application, Application.scheme_id == Scheme.id)
+            .join(Candidate, Candidate.current_application_id == Application.id)
+            .filter(Candidate.id == self.id)
             .first()
-            .scheme_id
         )
 
     def most_recent_application(self) -> "Application":
         return (
-            Application.query.filter(Application.candidate_id == self.id)
-            .order_by(Application.application_date.desc())
+            Application.query.join(
+                Candidate, Candidate.current_application_id == Application.id
+            )
+            .filter(Candidate.id == self.id)
             .first()
         )
 
     def current_location(self):
-        return self.roles.order_by(Role.id.desc()).first().location.value
+        return (
+            db.session.query(Location.value)
+            .join(Role, Role.location_id == Location.id)
+            .join(Candidate, Candidate.current_role_id == Role.id)
+            .filter(Candidate.id == self.id)
+            .scalar()
+        )
 
     def roles_since_date(self, since_date: datetime.date):
-        return [role for role in self.roles if role.date_started >= since_date]
+        return self.roles.filter(Role.date_started >= since_date).all()
+
+    @staticmethod
+    def role_change_types_since(
+        candidate_ids: Iterable[int], since_date: datetime.date
+    ) -> Dict[int, Set[int]]:
+        """
+        The kinds of role change each of `candidate_ids` has had since `since_date`, from one query. Candidates without
+        any are left out
+        """
+        role_changes = defaultdict(set)
+        for candidate_id, role_change_id in (
+            db.session.query(Role.candidate_id, Role.role_change_id)
+            .filter(
+                and_(
+                    Role.candidate_id.in_(list(candidate_ids)),
+                    Role.date_started >= since_date,
+                    Role.role_change_id.isnot(None),
+                )
+            )
+            .distinct()
+        ):
+            role_changes[candidate_id].add(role_change_id)
+        return dict(role_changes)
+
+    @staticmethod
+    def had_role_change_since(role_change_id: int, since_date: datetime.date):
+        """
+        Whether a candidate has had a role change of type `role_change_id` since `since_date`, as an EXISTS clause
+        correlated with the candidate table, so that a query for candidates can be filtered with a semi-join
+        :return: a SQL expression
+        """
+        return exists().where(
+            and_(
+                Role.candidate_id == Candidate.id,
+                Role.role_change_id == role_change_id,
+                Role.date_started >= since_date,
+            )
+        )
+
+    @staticmethod
+    def latest_role_id():
+        """
+        The id of a candidate's latest role, as a subquery correlated with the candidate table
+        """
+        return (
+            select([Role.id])
+            .where(Role.candidate_id == Candidate.id)
+            .order_by(Role.date_started.desc(), Role.id.desc())
+            .limit(1)
+            .as_scalar()
+        )
+
+    @staticmethod
+    def latest_application_id():
+        """
+        The id of a candidate's latest application, as a subquery correlated with the candidate table
+        """
+        return (
+            select([Application.id])
+            .where(Application.candidate_id == Candidate.id)
+            .order_by(Application.application_date.desc(), Application.id.desc())
+            .limit(1)
+            .as_scalar()
+        )
+
+    @classmethod
+    def current_state_for(cls, candidate_ids: Iterable[int]) -> Dict[int, CurrentState]:
+        """
+        The latest role, with its grade, location and organisation, and the latest application of each of
+        `candidate_ids`, from one query. Each candidate's roles and applications are numbered newest first and only
+        the first of each is joined, so this doesn't depend on the current pointers being up to date. Anything a
+        candidate doesn't have is None
+        """
+        candidate_ids = list(candidate_ids)
+        ranked_roles = (
+            select(
+                [
+                    Role.id,
+                    Role.candidate_id,
+                    func.row_number()
+                    .over(
+                        partition_by=Role.candidate_id,
+                        order_by=[Role.date_started.desc(), Role.id.desc()],
+                    )
+                    .label("position"),
+                ]
+            )
+            .where(Role.candidate_id.in_(candidate_ids))
+            .alias("ranked_roles")
+        )
+        ranked_applications = (
+            select(
+                [
+                    Application.id,
+                    Application.candidate_id,
+                    func.row_number()
+                    .over(
+                        partition_by=Application.candidate_id,
+                        order_by=[
+                            Application.application_date.desc(),
+                            Application.id.desc(),
+                        ],
+                    )
+                    .label("position"),
+                ]
+            )
+            .where(Application.candidate_id.in_(candidate_ids))
+            .alias("ranked_applications")
+        )
+        rows = (
+            db.session.query(cls.id, Role, Grade, Location, Organisation, Application)
+            .select_from(cls)
+            .outerjoin(
+                ranked_roles,
+                and_(
+                    ranked_roles.c.candidate_id == cls.id, ranked_roles.c.position == 1
+                ),
+            )
+            .outerjoin(Role, Role.id == ranked_roles.c.id)
+            .outerjoin(Grade, Grade.id == Role.grade_id)
+            .outerjoin(Location, Location.id == Role.location_id)
+            .outerjoin(Organisation, Organisation.id == Role.organisation_id)
+            .outerjoin(
+                ranked_applications,
+                and_(
+                    ranked_applications.c.candidate_id == cls.id,
+                    ranked_applications.c.position == 1,
+                ),
+            )
+            .outerjoin(Application, Application.id == ranked_applications.c.id)
+            .filter(cls.id.in_(candidate_ids))
+        )
+        return {candidate_id: CurrentState(*state) for candidate_id, *state in rows}
+
+    @classmethod
+    def refresh_current(cls, connection, candidate_ids=None) -> None:
+        """
+        Point `current_role_id` and `current_application_id` at the latest role and application of `candidate_ids`,
+        or of every candidate if no ids are passed
+        """
+        update = cls.__table__.update().values(
+            current_role_id=cls.latest_role_id(),
+            current_application_id=cls.latest_application_id(),
+        )
+        if candidate_ids is not None:
+            update = update.where(cls.id.in_(candidate_ids))
+        connection.execute(update)
+
+    @classmethod
+    def stale_current_pointers(cls, connection) -> List[int]:
+        """
+        The ids of candidates whose `current_role_id` or `current_application_id` doesn't point at their latest role
+        or application
+        """
+        return [
+            candidate_id
+            for candidate_id, in connection.execute(
+                select([cls.id])
+                .where(
+                    or_(
+                        cls.current_role_id.is_distinct_from(cls.latest_role_id()),
+                        cls.current_application_id.is_distinct_from(
+                            cls.latest_application_id()
+                        ),
+                    )
+                )
+                .order_by(cls.id)
+            )
+        ]
 
 
 class Organisation(db.Model):
@@ -222,6 +478,18 @@ class Location(db.Model):
 
 
 class Role(db.Model):
+    __table_args__ = (
+        # a candidate's roles in date order: their current role, and their history since a date
+        db.Index("ix_role_candidate_id_date_started", "candidate_id", "date_started"),
+        # whether, and when, a candidate had a particular kind of role change
+        db.Index(
+            "ix_role_candidate_id_role_change_id_date_started",
+            "candidate_id",
+            "role_change_id",
+            "date_started",
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     date_started = db.Column(db.Date())
     role_name = db.Column(db.String(256))
@@ -241,11 +509,13 @@ class Role(db.Model):
     def __repr__(self):
         return f"<Role held by {self.candidate} at {self.organisation_id}>"
 
-    def is_promotion(self):
-        role_before_this = (
-            self.candidate.roles.order_by(Role.date_started.desc()).limit(2).all()[1]
-        )
-        return self.grade.rank < role_before_this.grade.rank
+    def is_promotion(self) -> bool:
+        """
+        Whether this role was a step up in grade from the role the candidate held before it
+        """
+        from app.timelines import CareerTimeline
+
+        return CareerTimeline.for_candidates([self.candidate_id]).is_promotion(self.id)
 
 
 class Scheme(db.Model):
@@ -254,6 +524,21 @@ class Scheme(db.Model):
 
 
 class Application(db.Model):
+    __table_args__ = (
+        # an intake's cohort
+        db.Index(
+            "ix_application_scheme_id_scheme_start_date",
+            "scheme_id",
+            "scheme_start_date",
+        ),
+        # a candidate's applications in date order, for their latest application
+        db.Index(
+            "ix_application_candidate_id_application_date",
+            "candidate_id",
+            "application_date",
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
 
     aspirational_grade_id = db.Column(db.ForeignKey("grade.id"))
@@ -262,6 +547,9 @@ class Application(db.Model):
 
     application_date = db.Column(db.Date())
     scheme_start_date = db.Column(db.Date(), index=True)
+    # the year of scheme_start_date, kept in step with it so that reports can select an intake using an index. Writes
+    # through the session, including bulk updates, keep it in step; Core or raw SQL writes must set it themselves
+    intake_year = db.Column(db.Integer(), index=True)
     per_id = db.Column(db.Integer())
     employee_number = db.Column(db.String(25))
     successful = db.Column(db.Boolean())
@@ -272,6 +560,11 @@ class Application(db.Model):
 
     aspirational_grade = db.relationship("Grade", lazy="select")
 
+    @validates("scheme_start_date")
+    def set_intake_year(self, key, scheme_start_date: datetime.date):
+        self.intake_year = scheme_start_date.year if scheme_start_date else None
+        return scheme_start_date
+
     def defer(self, date_to_defer_to: datetime.date):
         self.scheme_start_date = date_to_defer_to
         return None
@@ -362,3 +655,238 @@ class AuditEvent(db.Model):
 class Promotion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     value = db.Column(db.String(28), index=True)
+
+
+class CandidatePromotionSummary(db.Model):
+    """
+    Each candidate's promotion history in one row, so that reports can ask whether a candidate was promoted during a
+    period with a range predicate instead of searching their roles. It's kept up to date as roles are written, by
+    `refresh_promotion_summaries` below, and `flask rebuild-promotion-summaries` rebuilds it from scratch
+    """
+
+    __tablename__ = "candidate_promotion_summary"
+    candidate_id = db.Column(
+        db.ForeignKey("candidate.id", ondelete="CASCADE"), primary_key=True
+    )
+    first_substantive_promotion = db.Column(db.Date(), index=True)
+    last_substantive_promotion = db.Column(db.Date())
+    first_temporary_promotion = db.Column(db.Date(), index=True)
+    last_temporary_promotion = db.Column(db.Date())
+    current_grade_rank = db.Column(db.Integer())
+    latest_role_id = db.Column(db.ForeignKey("role.id", ondelete="SET NULL"))
+
+    @classmethod
+    def promoted_between(
+        cls,
+        promoted_after_date: datetime.date,
+        promoted_before_date=None,
+        temporary=False,
+    ):
+        """
+        The set-based equivalent of `Candidate.promoted`. A candidate whose first or last promotion falls in the period
+        was promoted in it, and one whose promotions all came before or after it wasn't. Only a candidate promoted both
+        before and after the period needs their roles checked
+        :return: a SQL expression
+        """
+        if temporary:
+            first, last = cls.first_temporary_promotion, cls.last_temporary_promotion
+        else:
+            first, last = (
+                cls.first_substantive_promotion,
+                cls.last_substantive_promotion,
+            )
+        if not promoted_before_date:
+            promoted_before_date = datetime.today()
+        return or_(
+            first.between(promoted_after_date, promoted_before_date),
+            last.between(promoted_after_date, promoted_before_date),
+            and_(
+                first < promoted_after_date,
+                last > promoted_before_date,
+                exists().where(
+                    and_(
+                        Role.candidate_id == cls.candidate_id,
+                        Candidate.promotion_criteria(
+                            promoted_after_date, promoted_before_date, temporary
+                        ),
+                    )
+                ),
+            ),
+        )
+
+    @classmethod
+    def refresh(cls, connection, candidate_ids=None) -> None:
+        """
+        Recalculate the summaries of `candidate_ids` from their roles, or everyone's if no ids are passed. Candidates
+        without roles don't have a summary
+        """
+        role = Role.__table__
+        latest_role = role.alias("latest_role")
+
+        def role_change_id(value):
+            return (
+                select([Promotion.id])
+                .where(Promotion.value.like(f"%{value}%"))
+                .order_by(Promotion.id)
+                .limit(1)
+                .as_scalar()
+            )
+
+        def promotion_date(aggregate, value):
+            return aggregate(
+                case(
+                    [
+                        (
+                            role.c.role_change_id == role_change_id(value),
+                            role.c.date_started,
+                        )
+                    ]
+                )
+            )
+
+        def latest(column):
+            return (
+                select([column])
+                .select_from(
+                    latest_role.outerjoin(
+                        Grade.__table__, Grade.id == latest_role.c.grade_id
+                    )
+                )
+                .where(latest_role.c.candidate_id == role.c.candidate_id)
+                .order_by(latest_role.c.date_started.desc(), latest_role.c.id.desc())
+                .limit(1)
+                .as_scalar()
+            )
+
+        summaries = select(
+            [
+                role.c.candidate_id,
+                promotion_date(func.min, "substantive"),
+                promotion_date(func.max, "substantive"),
+                promotion_date(func.min, "temporary"),
+                promotion_date(func.max, "temporary"),
+                latest(Grade.rank),
+                latest(latest_role.c.id),
+            ]
+        ).where(role.c.candidate_id.isnot(None))
+        delete = cls.__table__.delete()
+        if candidate_ids is not None:
+            summaries = summaries.where(role.c.candidate_id.in_(candidate_ids))
+            delete = delete.where(cls.candidate_id.in_(candidate_ids))
+        connection.execute(delete)
+        connection.execute(
+            cls.__table__.insert().from_select(
+                [
+                    cls.candidate_id,
+                    cls.first_substantive_promotion,
+                    cls.last_substantive_promotion,
+                    cls.first_temporary_promotion,
+                    cls.last_temporary_promotion,
+                    cls.current_grade_rank,
+                    cls.latest_role_id,
+                ],
+                summaries.group_by(role.c.candidate_id),
+            )
+        )
+
+
+@event.listens_for(Session, "after_flush")
+def refresh_promotion_summaries(session, flush_context):
+    """
+    Recalculate the summaries of candidates whose roles were just written, inside the same transaction
+    """
+    if any(
+        isinstance(instance, (Promotion, Grade))
+        for instance in chain(session.dirty, session.deleted)
+    ):
+        # renaming a kind of role change, or re-ranking a grade, can change anyone's summary
+        CandidatePromotionSummary.refresh(session.connection())
+        return
+    candidate_ids = set()
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, Role):
+            candidate_ids.add(instance.candidate_id)
+            # a role moved from one candidate to another changes both summaries
+            candidate_ids.update(inspect(instance).attrs.candidate_id.history.deleted)
+    candidate_ids.discard(None)
+    if candidate_ids:
+        CandidatePromotionSummary.refresh(session.connection(), candidate_ids)
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def rebuild_promotion_summaries(context):
+    """
+    Bulk writes don't say which rows they changed, so every summary is recalculated
+    """
+    if context.mapper.class_ in (Role, Promotion, Grade):
+        CandidatePromotionSummary.refresh(context.session.connection())
+
+
+class ReportDataVersion(db.Model):
+    """
+    A single row counting changes to the data reports are built from. It's in the database, rather than the report
+    cache, so every web worker, report process and host sees the same version, and it changes in the same transaction
+    as the data. See reporting.cache
+    """
+
+    __tablename__ = "report_data_version"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+@event.listens_for(Session, "after_flush")
+def refresh_current_pointers(session, flush_context):
+    """
+    Re-point the candidates whose roles or applications were just written at their latest ones, inside the same
+    transaction. Their loaded pointers are expired once the flush is over, by `expire_current_pointers`
+    """
+    candidate_ids = set()
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, (Role, Application)):
+            candidate_ids.add(instance.candidate_id)
+            candidate_ids.update(inspect(instance).attrs.candidate_id.history.deleted)
+    candidate_ids.discard(None)
+    if candidate_ids:
+        Candidate.refresh_current(session.connection(), candidate_ids)
+        session.info.setdefault("refreshed_candidates", set()).update(candidate_ids)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def expire_current_pointers(session, flush_context):
+    mapper = inspect(Candidate)
+    for candidate_id in session.info.pop("refreshed_candidates", ()):
+        candidate = session.identity_map.get(
+            mapper.identity_key_from_primary_key([candidate_id])
+        )
+        if candidate is not None:
+            session.expire(candidate, ["current_role_id", "current_application_id"])
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def rebuild_current_pointers(context):
+    if context.mapper.class_ in (Role, Application):
+        Candidate.refresh_current(context.session.connection())
+
+
+@event.listens_for(Session, "after_bulk_update")
+def refresh_intake_years(context):
+    """
+    A bulk update doesn't go through `Application.set_intake_year`, so intake years are brought back into step with
+    any scheme start dates it changed
+    """
+    if context.mapper.class_ is Application and any(
+        getattr(key, "key", key) == "scheme_start_date" for key in context.values
+    ):
+        table = Application.__table__
+        intake_year = cast(extract("year", table.c.scheme_start_date), Integer)
+        context.session.connection().execute(
+            table.update()
+            .where(table.c.intake_year.is_distinct_from(intake_year))
+            .values(intake_year=intake_year)
+        )
+
+
+# the search index is kept up to date by listeners on these models, wherever they're used
+from app import search  # noqa: E402,F401
@@ -0,0 +1,45 @@
+from typing import Any, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Query
+
+
+class KeysetPage(NamedTuple):
+    items: List[Any]
+    # the keys to ask for to get the next and previous pages, or None if there isn't one
+    next_key: Optional[int]
+    previous_key: Optional[int]
+
+
+def keyset_page(
+    query: Query,
+    key,
+    size: int,
+    after: Optional[int] = None,
+    before: Optional[int] = None,
+) -> KeysetPage:
+    """
+    The page of `size` rows from `query`, in `key` order, that comes straight after the row whose key is `after`, or
+    straight before the one whose key is `before`. With neither it's the first page.
+
+    Unlike an OFFSET, which has the database count its way through every earlier page, this starts from the index on
+    `key`, so a page is as quick to load at the end of the list as at the start. One row more than the page is read, to
+    find out whether there's another page in the direction of travel. `key` must be unique and each item must have it
+    as an attribute of the same name
+    """
+    if before is not None:
+        rows = query.filter(key < before).order_by(key.desc()).limit(size + 1).all()
+        items = list(reversed(rows[:size]))
+        has_next, has_previous = True, len(rows) > size
+    else:
+        if after is not None:
+            query = query.filter(key > after)
+        rows = query.order_by(key).limit(size + 1).all()
+        items = rows[:size]
+        has_next, has_previous = len(rows) > size, after is not None
+    if not items:
+        return KeysetPage(items, None, None)
+    return KeysetPage(
+        items,
+        getattr(items[-1], key.key) if has_next else None,
+        getattr(items[0], key.key) if has_previous else None,
+    )
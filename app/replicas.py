@@ -0,0 +1,127 @@
+"""
+Sends read-only work to a read replica of the database, so that long reports don't hold locks on, or compete for, the
+primary that caseworkers are updating. Set SQLALCHEMY_REPLICA_URI to the replica's URL; without it everything uses the
+primary, as before.
+
+Reads only go to the replica inside `replica_routing.reading()`, or in a view decorated with
+`replica_routing.read_only`. Even there the primary is used:
+
+- once the session has written anything, so a request reads back its own changes
+- for REPLICA_READ_YOUR_WRITES seconds after a user commits a change, since the replica may not have caught up yet.
+  Work done for the user away from their request, such as a report job, passes on the time their window ends
+
+Work done inside `engine_profiles.workload(name)` goes to that profile's engine on whichever database was chosen.
+"""
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Optional
+
+from flask import current_app, has_request_context, session as user_session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import event, orm
+
+from app.engines import engine_profiles
+
+REPLICA = "replica"
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        bind = None
+        if (
+            self.info.get("read_replica")
+            and not self.info.get("written")
+            and (self.app.config.get("SQLALCHEMY_BINDS") or {}).get(REPLICA)
+        ):
+            bind = REPLICA
+        profile = self.info.get("engine_profile")
+        if engine_profiles.has_engine(self.app, profile):
+            return engine_profiles.engine(self.app, profile, bind)
+        if bind:
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouting:
+    # tables whose writes nobody reads back through the replica, so writing them doesn't pin a user to the primary
+    unreplicated_tables = {"audit_event"}
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SQLALCHEMY_REPLICA_URI", None)
+        app.config.setdefault("REPLICA_READ_YOUR_WRITES", 10)
+        if app.config["SQLALCHEMY_REPLICA_URI"]:
+            app.config["SQLALCHEMY_BINDS"] = {
+                **(app.config.get("SQLALCHEMY_BINDS") or {}),
+                REPLICA: app.config["SQLALCHEMY_REPLICA_URI"],
+            }
+
+    @staticmethod
+    def primary_reads_until() -> float:
+        """
+        When the current user's reads can go back to the replica, as a timestamp
+        """
+        if not has_request_context():
+            return 0
+        return user_session.get("primary_reads_until", 0)
+
+    def recently_wrote(self, primary_reads_until: Optional[float] = None) -> bool:
+        if primary_reads_until is None:
+            primary_reads_until = self.primary_reads_until()
+        return primary_reads_until > time.time()
+
+    @contextmanager
+    def reading(self, primary_reads_until: Optional[float] = None):
+        """
+        Route the session's reads to the replica until the block ends. Outside the user's request, pass their
+        `primary_reads_until` from when the work was asked for
+        """
+        session = get_state(current_app).db.session()
+        previous = session.info.get("read_replica")
+        session.info["read_replica"] = not self.recently_wrote(primary_reads_until)
+        try:
+            yield
+        finally:
+            session.info["read_replica"] = previous
+
+    def read_only(self, view):
+        @wraps(view)
+        def read_from_replica(*args, **kwargs):
+            with self.reading():
+                return view(*args, **kwargs)
+
+        return read_from_replica
+
+
+replica_routing = ReplicaRouting()
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def note_writes(session, flush_context, instances):
+    if any(
+        instance.__table__.name not in ReplicaRouting.unreplicated_tables
+        for instance in (*session.new, *session.dirty, *session.deleted)
+    ):
+        session.info["written"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def read_own_writes(session):
+    if session.info.pop("written", False) and has_request_context():
+        user_session["primary_reads_until"] = (
+            time.time() + session.app.config["REPLICA_READ_YOUR_WRITES"]
+        )
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def forget_writes(session):
+    session.info.pop("written", None)
@@ -1,34 +1,62 @@
-from flask import request, render_template
+from flask import request, render_template, jsonify, abort, send_file
 from app.reports import reports_bp
-from reporting import ReportFactory
-from reporting.detailed_report import DetailedReport
+from reporting.jobs import report_jobs, ReportJob, COMPLETE
+from app.lookups import lookups
 from app.models import Promotion
 
 
+def job_response(job: ReportJob):
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(job._asdict())
+    return render_template(
+        "reports/job.html", page_header="Your report", job=job, complete=COMPLETE
+    )
+
+
 @reports_bp.route("/", methods=["POST", "GET"])
 def reports():
 
     if request.method == "POST":
         form_data = request.form.to_dict()
-        report = ReportFactory.create_report(
-            report_type=form_data.pop("report-type"), **form_data
-        )
-        return report.return_data()
+        report_type = form_data.pop("report-type")
+        return job_response(report_jobs.submit(report_type, form_data))
     return render_template("reports/select-report.html")
 
 
 @reports_bp.route("/detailed", methods=["POST", "GET"])
 def detailed_reports():
     if request.method == "POST":
-        form_data = request.form.to_dict()
-        report = DetailedReport(
-            form_data.get("year"),
-            form_data.get("scheme"),
-            form_data.get("promotion-type"),
-        )
-        return report.return_data()
+        return job_response(report_jobs.submit("detailed", request.form.to_dict()))
     return render_template(
         "reports/detailed-report.html",
         page_header="Detailed Report",
-        promotion_types=Promotion.query.all(),
+        promotion_types=lookups.table(Promotion),
+    )
+
+
+@reports_bp.route("/trends", methods=["POST", "GET"])
+def trend_reports():
+    if request.method == "POST":
+        return job_response(report_jobs.submit("trends", request.form.to_dict()))
+    return render_template("reports/trend-report.html", page_header="Promotion trends")
+
+
+@reports_bp.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = report_jobs.store.get(job_id)
+    if not job:
+        return abort(404)
+    return job_response(job)
+
+
+@reports_bp.route("/jobs/<job_id>/download", methods=["GET"])
+def download_report(job_id):
+    job = report_jobs.store.get(job_id)
+    if not job or job.status != COMPLETE:
+        return abort(404)
+    return send_file(
+        report_jobs.store.output_path(job.id),
+        mimetype="text/csv",
+        as_attachment=True,
+        attachment_filename=f"{job.filename}.csv",
     )
@@ -1,7 +1,15 @@
 from datetime import date
 from typing import Dict
 
-from flask import render_template, request, url_for, redirect, session
+from flask import (
+    current_app,
+    jsonify,
+    render_template,
+    request,
+    url_for,
+    redirect,
+    session,
+)
 from app.models import (
     Candidate,
     Grade,
@@ -13,6 +21,12 @@ from app.models import (
     Promotion,
 )
 from app.routes import route_blueprint
+from app.loading import loader_profile
+from app.pagination import keyset_page
+from app.search import search
+from app.lookups import lookups
+from app.engines import engine_profiles
+from app.replicas import replica_routing
 
 
 @route_blueprint.route("/")
@@ -25,12 +39,67 @@ def hello():
     return "Hello world"
 
 
+def candidate_listing(candidate: Candidate) -> Dict:
+    return {
+        "id": candidate.id,
+        "email_address": candidate.email_address,
+        "roles": [
+            {
+                "id": role.id,
+                "date_started": role.date_started and role.date_started.isoformat(),
+                "organisation": role.organisation and role.organisation.name,
+            }
+            for role in candidate.role_history
+        ],
+    }
+
+
 @route_blueprint.route("/results")
+@replica_routing.read_only
 def results():
-    candidates = Candidate.query.all()
+    """
+    Every candidate, a page at a time in id order, with the organisation of each of their roles. Pass `after` or
+    `before` a candidate's id to move between pages, and `page-size` for up to RESULTS_MAX_PAGE_SIZE candidates a page.
+    Scripts can ask for the page as JSON with an Accept: application/json header
+    """
+    page_size = min(
+        max(
+            request.args.get(
+                "page-size", current_app.config["RESULTS_PAGE_SIZE"], type=int
+            ),
+            1,
+        ),
+        current_app.config["RESULTS_MAX_PAGE_SIZE"],
+    )
+    page = keyset_page(
+        Candidate.query.options(*loader_profile("listing")),
+        Candidate.id,
+        page_size,
+        after=request.args.get("after", type=int),
+        before=request.args.get("before", type=int),
+    )
+    next_page = (
+        url_for(".results", after=page.next_key, **{"page-size": page_size})
+        if page.next_key
+        else None
+    )
+    previous_page = (
+        url_for(".results", before=page.previous_key, **{"page-size": page_size})
+        if page.previous_key
+        else None
+    )
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(
+            candidates=[candidate_listing(candidate) for candidate in page.items],
+            page_size=page_size,
+            next=next_page,
+            previous=previous_page,
+        )
     return render_template(
         "results.html",
-        candidates=candidates,
+        candidates=page.items,
+        next_page=next_page,
+        previous_page=previous_page,
         heading="Search results",
         accordion_data=[{"heading": "Heading", "content": "Lorem ipsum, blah blah"}],
     )
@@ -53,14 +122,25 @@ def search_candidate():
         "deferral": "route_blueprint.defer_intake",
     }
     if request.method == "POST":
-        candidate = Candidate.query.filter_by(
-            email_address=request.form.get("candidate-email")
-        ).one_or_none()
-        if candidate:
-            session["candidate-id"] = candidate.id
-        else:
-            session["error"] = "That email does not exist"
+        search_text = request.form.get("candidate-email", "")
+        candidate_id = request.form.get("candidate-id", type=int)
+        if candidate_id is None:
+            candidate = Candidate.query.filter_by(
+                email_address=search_text
+            ).one_or_none()
+            candidate_id = candidate.id if candidate else None
+        if candidate_id is None:
+            # anything but an exact email address is confirmed from the list of matches
+            matches = search(search_text)
+            if matches:
+                return render_template(
+                    "search-candidate.html", matches=matches, search_text=search_text
+                )
+            session[
+                "error"
+            ] = "No candidate matches that name, email address, employee number or PER id"
             return redirect(url_for("route_blueprint.search_candidate"))
+        session["candidate-id"] = candidate_id
         return redirect(url_for(next_steps.get(session.get("update-type"))))
     return render_template("search-candidate.html", error=session.pop("error", None))
 
@@ -84,10 +164,10 @@ def update_role():
         "promotable_grades": Grade.new_grades(
             Candidate.query.get(candidate_id).current_grade()
         ),
-        "organisations": Organisation.query.all(),
-        "locations": Location.query.all(),
-        "professions": Profession.query.all(),
-        "role_changes": Promotion.query.all(),
+        "organisations": lookups.table(Organisation),
+        "locations": lookups.table(Location),
+        "professions": lookups.table(Profession),
+        "role_changes": lookups.table(Promotion),
     }
     return render_template(
         "updates/role.html",
@@ -198,11 +278,13 @@ def check_your_answers():
         data.pop("start-date-year")
         role_id = data.pop("role-change")
         data = {prettify_string(key): value for key, value in data.items()}
-        data["New grade"] = Grade.query.get(data["New grade"]).value
-        data["New location"] = Location.query.get(data["New location"]).value
-        data["New org"] = Organisation.query.get(data["New org"]).name
-        data["New profession"] = Profession.query.get(data["New profession"]).value
-        data["Role change type"] = Promotion.query.get(role_id).value
+        data["New grade"] = lookups.table(Grade).get(data["New grade"]).value
+        data["New location"] = lookups.table(Location).get(data["New location"]).value
+        data["New org"] = lookups.table(Organisation).get(data["New org"]).name
+        data["New profession"] = (
+            lookups.table(Profession).get(data["New profession"]).value
+        )
+        data["Role change type"] = lookups.table(Promotion).get(role_id).value
 
         return data
 
@@ -229,9 +311,16 @@ def complete():
 
 
 @route_blueprint.route("/candidate")
+@replica_routing.read_only
 def candidate():
     return render_template(
         "candidates/profile.html",
         roles=Role.query.order_by(Role.date_started.desc()).all(),
-        candidate=Candidate.query.get(2),
+        candidate=Candidate.query.options(*loader_profile("profile")).get(2),
+        current=Candidate.current_state_for([2]).get(2),
     )
+
+
+@route_blueprint.route("/metrics/database-pools")
+def database_pool_metrics():
+    return jsonify(engine_profiles.metrics())
@@ -0,0 +1,392 @@
+"""
+Finds candidates from part of their name, email address, employee number or PER id, for the candidate search and its
+typeahead. Matching runs against the `candidate_search` table, which holds one row of searchable text per candidate and
+is kept up to date as candidates and applications are written, by `refresh_search_index` below. `flask
+rebuild-search-index` rebuilds it from scratch.
+
+The table is indexed for substring and trigram matching:
+
+- on SQLite it's an FTS5 table with the trigram tokenizer, so any three or more characters can be looked up in it
+- on Postgres it's an ordinary table with a pg_trgm GIN index over the whole text, which serves both ILIKE and the
+  word similarity operator `<%`. Where pg_trgm can't be installed the table has no index, and only ILIKE is used
+
+Candidates containing the search text are found first, with those where it starts a word ahead of the rest. If none
+do, candidates whose text shares enough of the search's trigrams to reach SEARCH_SIMILARITY_THRESHOLD are found
+instead, which is what finds a name with a typo in it.
+"""
+import re
+from collections import defaultdict
+from itertools import chain
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+from flask import current_app
+from sqlalchemy import (
+    DDL,
+    Integer,
+    Text,
+    event,
+    func,
+    inspect,
+    literal,
+    literal_column,
+    or_,
+    select,
+    union_all,
+)
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import column, table
+
+from app.models import Application, Candidate, db
+
+SEARCH_TABLE = "candidate_search"
+
+# searches shorter than this return nothing, since they can't be looked up by trigram
+MIN_QUERY_LENGTH = 3
+
+# how many rows are read for each result wanted, to be ranked in Python
+ROWS_READ_PER_RESULT = 5
+# the most rows sharing trigrams with a search that FTS5 is asked to rank
+MAX_ROWS_TO_RANK = 5000
+
+# FTS5 has no name for the rowid, so on SQLite the candidate's id is kept in it
+fts_index = table(
+    SEARCH_TABLE,
+    column("rowid", Integer),
+    column("name", Text),
+    column("email_address", Text),
+    column("identifiers", Text),
+)
+trigram_index = table(
+    SEARCH_TABLE,
+    column("candidate_id", Integer),
+    column("name", Text),
+    column("email_address", Text),
+    column("identifiers", Text),
+)
+
+event.listen(
+    db.metadata,
+    "after_create",
+    DDL(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+        "USING fts5(name, email_address, identifiers, tokenize = 'trigram')"
+    ).execute_if(dialect="sqlite"),
+)
+
+
+def trigram_extension_available(connection) -> bool:
+    return connection.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')"
+    ).scalar()
+
+
+def has_trigram_matching(connection) -> bool:
+    """
+    Whether pg_trgm is installed in the connection's database. It's looked up once for each database connection
+    """
+    info = connection.connection.info
+    if "pg_trgm" not in info:
+        info["pg_trgm"] = connection.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"
+        ).scalar()
+    return info["pg_trgm"]
+
+
+event.listen(
+    db.metadata,
+    "after_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(
+        dialect="postgresql",
+        callable_=lambda ddl, target, bind, **kw: trigram_extension_available(bind),
+    ),
+)
+event.listen(
+    db.metadata,
+    "after_create",
+    DDL(
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+        "candidate_id INTEGER PRIMARY KEY REFERENCES candidate (id) ON DELETE CASCADE, "
+        "name TEXT NOT NULL, email_address TEXT NOT NULL, identifiers TEXT NOT NULL)"
+    ).execute_if(dialect="postgresql"),
+)
+event.listen(
+    db.metadata,
+    "after_create",
+    DDL(
+        f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} "
+        "USING gin ((name || ' ' || email_address || ' ' || identifiers) gin_trgm_ops)"
+    ).execute_if(
+        dialect="postgresql",
+        callable_=lambda ddl, target, bind, **kw: has_trigram_matching(bind),
+    ),
+)
+event.listen(db.metadata, "before_drop", DDL(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+
+
+class SearchResult(NamedTuple):
+    candidate_id: int
+    name: str
+    email_address: str
+    identifiers: str
+
+
+def index_for(dialect_name: str):
+    """
+    The search table as it's laid out on `dialect_name`, and the column holding the candidate's id
+    """
+    if dialect_name == "sqlite":
+        return fts_index, fts_index.c.rowid
+    return trigram_index, trigram_index.c.candidate_id
+
+
+def normalise(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def trigrams(text: str) -> Set[str]:
+    """
+    The trigrams of each word in `text`, padded at the ends in the same way as pg_trgm, so that the start of a word
+    counts for more than its middle
+    """
+    grams = set()
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        padded = f"  {word} "
+        grams.update(map("".join, zip(padded, padded[1:], padded[2:])))
+    return grams
+
+
+def word_similarity(query: str, text: str) -> float:
+    """
+    The share of the trigrams in `query` that are also in `text`, from 0 to 1. Like pg_trgm's word_similarity, it
+    doesn't matter how much else `text` contains
+    """
+    wanted = trigrams(query)
+    return len(wanted & trigrams(text)) / len(wanted) if wanted else 0.0
+
+
+def refresh(connection, candidate_ids: Optional[Iterable[int]] = None) -> None:
+    """
+    Rewrite the search rows of `candidate_ids` from their candidate and applications, or everyone's if no ids are
+    passed
+    """
+    index, key = index_for(connection.dialect.name)
+    candidates = select(
+        [
+            Candidate.id,
+            Candidate.first_name,
+            Candidate.last_name,
+            Candidate.email_address,
+        ]
+    )
+    applications = (
+        select(
+            [Application.candidate_id, Application.per_id, Application.employee_number]
+        )
+        .where(
+            or_(Application.per_id.isnot(None), Application.employee_number.isnot(None))
+        )
+        .order_by(Application.candidate_id, Application.id)
+    )
+    delete = index.delete()
+    if candidate_ids is not None:
+        candidate_ids = list(candidate_ids)
+        candidates = candidates.where(Candidate.id.in_(candidate_ids))
+        applications = applications.where(Application.candidate_id.in_(candidate_ids))
+        delete = delete.where(key.in_(candidate_ids))
+
+    identifiers: Dict[int, List[str]] = defaultdict(list)
+    for candidate_id, per_id, employee_number in connection.execute(applications):
+        for identifier in (per_id, employee_number):
+            if (
+                identifier is not None
+                and str(identifier) not in identifiers[candidate_id]
+            ):
+                identifiers[candidate_id].append(str(identifier))
+    rows = [
+        {
+            key.name: candidate_id,
+            "name": " ".join(name for name in (first_name, last_name) if name),
+            "email_address": email_address or "",
+            "identifiers": " ".join(identifiers[candidate_id]),
+        }
+        for candidate_id, first_name, last_name, email_address in connection.execute(
+            candidates
+        )
+    ]
+    connection.execute(delete)
+    if rows:
+        connection.execute(index.insert(), rows)
+
+
+def search(query: str, limit: int = 10) -> List[SearchResult]:
+    """
+    Up to `limit` candidates matching `query`, best first
+    """
+    query = normalise(query)
+    if len(query) < MIN_QUERY_LENGTH:
+        return []
+    threshold = current_app.config["SEARCH_SIMILARITY_THRESHOLD"]
+    if db.session.get_bind().dialect.name == "postgresql":
+        return search_trigram_index(query, limit, threshold)
+    return search_fts_index(query, limit, threshold)
+
+
+def starts_word(query: str, text: str) -> bool:
+    return re.search(r"(?<![a-z0-9])" + re.escape(query), text.lower()) is not None
+
+
+def ranked(query: str, results: Iterable[SearchResult]) -> List[SearchResult]:
+    """
+    `results` with those where `query` starts a word first, then the most similar to it
+    """
+
+    def rank(result: SearchResult):
+        text = " ".join(result[1:])
+        return (
+            not starts_word(query, text),
+            -word_similarity(query, text),
+            result.candidate_id,
+        )
+
+    return sorted(results, key=rank)
+
+
+def search_fts_index(query: str, limit: int, threshold: float) -> List[SearchResult]:
+    """
+    Search the FTS5 table. FTS5 can find the rows containing a phrase, or any of several trigrams, quickly, but ranking
+    every one of them takes as long as reading them all, which for a common word is most of the table. So a few more
+    rows than are needed are read in any order and ranked here.
+
+    A phrase finds the candidates containing the whole search. If there aren't any, candidates sharing the search's
+    rarest trigrams are found instead, and kept if they're similar enough. Those are ranked by FTS5 when there aren't
+    too many of them
+    """
+    index, key = index_for("sqlite")
+    columns = [key, index.c.name, index.c.email_address, index.c.identifiers]
+    matches = literal_column(SEARCH_TABLE).match
+
+    def phrase(text: str) -> str:
+        return '"' + text.replace('"', '""') + '"'
+
+    containing = [
+        SearchResult(*row)
+        for row in db.session.execute(
+            select(columns)
+            .where(matches(phrase(query)))
+            .limit(limit * ROWS_READ_PER_RESULT)
+        )
+    ]
+    if containing:
+        return ranked(query, containing)[:limit]
+
+    # how many rows each of the search's trigrams is in, counting no higher than the most FTS5 is asked to rank
+    grams = sorted(set(map("".join, zip(query, query[1:], query[2:]))))
+    counts = [
+        select(
+            [
+                literal(gram),
+                select([func.count()])
+                .select_from(
+                    select([key])
+                    .where(matches(phrase(gram)))
+                    .limit(MAX_ROWS_TO_RANK + 1)
+                    .alias()
+                )
+                .as_scalar(),
+            ]
+        )
+        for gram in grams
+    ]
+    rows_with = {
+        gram: count for gram, count in db.session.execute(union_all(*counts)) if count
+    }
+    rarest, rows_to_rank = [], 0
+    for gram in sorted(rows_with, key=rows_with.get):
+        if rarest and rows_to_rank + rows_with[gram] > MAX_ROWS_TO_RANK:
+            break
+        rarest.append(gram)
+        rows_to_rank += rows_with[gram]
+    if not rarest:
+        return []
+
+    sharing = select(columns).where(matches(" OR ".join(map(phrase, rarest))))
+    if rows_to_rank <= MAX_ROWS_TO_RANK:
+        sharing = sharing.order_by(literal_column("rank"))
+    similar = [
+        result
+        for result in (
+            SearchResult(*row)
+            for row in db.session.execute(sharing.limit(limit * ROWS_READ_PER_RESULT))
+        )
+        if word_similarity(query, " ".join(result[1:])) >= threshold
+    ]
+    return ranked(query, similar)[:limit]
+
+
+def search_trigram_index(
+    query: str, limit: int, threshold: float
+) -> List[SearchResult]:
+    """
+    Search the pg_trgm index. ILIKE finds the candidates containing the whole search, which are ranked here as they are
+    on SQLite. If there aren't any, `<%` finds those sharing enough of its trigrams, with the similarity threshold set
+    for this transaction. Without pg_trgm only the ILIKE search is made
+    """
+    index, key = index_for("postgresql")
+    columns = [key, index.c.name, index.c.email_address, index.c.identifiers]
+    # written out the same way as the index's expression, so that the index is used
+    space = literal_column("' '")
+    document = (
+        index.c.name + space + index.c.email_address + space + index.c.identifiers
+    )
+
+    pattern = re.sub(r"([\\%_])", r"\\\1", query)
+    containing = [
+        SearchResult(*row)
+        for row in db.session.execute(
+            select(columns)
+            .where(document.ilike(f"%{pattern}%"))
+            .limit(limit * ROWS_READ_PER_RESULT)
+        )
+    ]
+    if containing or not has_trigram_matching(db.session.connection()):
+        return ranked(query, containing)[:limit]
+
+    db.session.execute(
+        select(
+            [func.set_config("pg_trgm.word_similarity_threshold", str(threshold), True)]
+        )
+    )
+    return [
+        SearchResult(*row)
+        for row in db.session.execute(
+            select(columns)
+            .where(literal(query).op("<%")(document))
+            .order_by(func.word_similarity(query, document).desc(), key)
+            .limit(limit)
+        )
+    ]
+
+
+@event.listens_for(Session, "after_flush")
+def refresh_search_index(session, flush_context):
+    """
+    Rewrite the search rows of candidates whose names, email addresses or applications were just written, inside the
+    same transaction
+    """
+    candidate_ids = set()
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, Candidate):
+            candidate_ids.add(instance.id)
+        elif isinstance(instance, Application):
+            candidate_ids.add(instance.candidate_id)
+            candidate_ids.update(inspect(instance).attrs.candidate_id.history.deleted)
+    candidate_ids.discard(None)
+    if candidate_ids:
+        refresh(session.connection(), candidate_ids)
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def rebuild_search_index(context):
+    if context.mapper.class_ in (Candidate, Application):
+        refresh(context.session.connection())
@@ -0,0 +1,94 @@
+from typing import Iterable, Optional
+
+import numpy as np
+
+from app.models import db, Grade, Role
+
+TRANSITION = np.dtype(
+    [
+        ("candidate_id", "i8"),
+        ("from_role_id", "i8"),
+        ("to_role_id", "i8"),
+        ("started", "datetime64[D]"),
+        ("role_change_id", "i8"),
+        ("rank_delta", "f8"),
+        ("duration", "timedelta64[D]"),
+    ]
+)
+
+
+class CareerTimeline:
+    """
+    The role histories of a set of candidates, held as arrays in (candidate, date started) order, and every move from
+    one role to the next within a candidate's history. Each transition has:
+
+    - `rank_delta`: how many grades the candidate moved up. Lower ranks are more senior, so a promotion is positive, a
+      demotion negative and a level transfer zero. It's NaN if either role has no grade
+    - `role_change_id`: the kind of role change the new role was recorded as, or 0 if it wasn't recorded
+    - `duration`: how long the candidate spent in the role they moved from
+    """
+
+    def __init__(self, role_ids, candidate_ids, dates, ranks, role_change_ids):
+        self.role_ids = np.asarray(role_ids, dtype="i8")
+        self.candidate_ids = np.asarray(candidate_ids, dtype="i8")
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.ranks = np.asarray(ranks, dtype="f8")
+        self.role_change_ids = np.asarray(role_change_ids, dtype="i8")
+
+        # a transition is a pair of neighbouring roles held by the same candidate
+        before = np.flatnonzero(self.candidate_ids[1:] == self.candidate_ids[:-1])
+        after = before + 1
+        self.transitions = np.empty(len(before), dtype=TRANSITION)
+        self.transitions["candidate_id"] = self.candidate_ids[after]
+        self.transitions["from_role_id"] = self.role_ids[before]
+        self.transitions["to_role_id"] = self.role_ids[after]
+        self.transitions["started"] = self.dates[after]
+        self.transitions["role_change_id"] = self.role_change_ids[after]
+        self.transitions["rank_delta"] = self.ranks[before] - self.ranks[after]
+        self.transitions["duration"] = self.dates[after] - self.dates[before]
+
+    @classmethod
+    def for_candidates(cls, candidate_ids: Optional[Iterable[int]] = None):
+        """
+        Load the role histories of `candidate_ids`, or of every candidate, in one query
+        """
+        query = (
+            db.session.query(
+                Role.id,
+                Role.candidate_id,
+                Role.date_started,
+                Grade.rank,
+                Role.role_change_id,
+            )
+            .outerjoin(Grade, Grade.id == Role.grade_id)
+            .filter(Role.candidate_id.isnot(None))
+            .order_by(Role.candidate_id, Role.date_started, Role.id)
+        )
+        if candidate_ids is not None:
+            query = query.filter(Role.candidate_id.in_(list(candidate_ids)))
+        rows = query.all()
+        return cls(
+            [row[0] for row in rows],
+            [row[1] for row in rows],
+            [row[2] for row in rows],
+            [row[3] for row in rows],
+            [row[4] or 0 for row in rows],
+        )
+
+    def promotions(self, role_change_id: Optional[int] = None) -> np.ndarray:
+        """
+        The transitions that moved a candidate up at least one grade, optionally only those recorded as
+        `role_change_id`
+        """
+        promoted = self.transitions["rank_delta"] > 0
+        if role_change_id is not None:
+            promoted &= self.transitions["role_change_id"] == role_change_id
+        return self.transitions[promoted]
+
+    def is_promotion(self, role_id: int) -> bool:
+        """
+        Whether the candidate moved up a grade when they started `role_id`, compared with the role they held before
+        it. A candidate's first role isn't a promotion
+        """
+        into_role = self.transitions["to_role_id"] == role_id
+        return bool(np.any(self.transitions["rank_delta"][into_role] > 0))
@@ -0,0 +1,62 @@
+"""
+Compare two result files from `benchmarks.run`, report by report.
+
+    python -m benchmarks.compare before.json after.json --threshold 1.2
+
+Exits with status 1 if any report got slower, or used more memory, by more than the threshold ratio
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Tuple
+
+
+def load(path: str) -> Tuple[Dict, Dict]:
+    with open(path) as results_file:
+        results = json.load(results_file)
+    return (
+        results["metadata"],
+        {(result["size"], result["report"]): result for result in results["results"]},
+    )
+
+
+def ratio(before: float, after: float) -> float:
+    try:
+        return after / before
+    except ZeroDivisionError:
+        return 1.0
+
+
+def main(arguments=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    options = parser.parse_args(arguments)
+
+    before_metadata, before = load(options.before)
+    after_metadata, after = load(options.after)
+    print(f"before: {before_metadata['commit']}  after: {after_metadata['commit']}")
+    print(f"{'size':>8} {'report':<50} {'time':>8} {'memory':>8}")
+
+    regressions = 0
+    for key in sorted(set(before) & set(after)):
+        time_ratio = ratio(before[key]["seconds"], after[key]["seconds"])
+        memory_ratio = ratio(
+            before[key]["peak_memory_bytes"], after[key]["peak_memory_bytes"]
+        )
+        regressed = max(time_ratio, memory_ratio) > options.threshold
+        regressions += regressed
+        print(
+            f"{key[0]:>8} {key[1]:<50} {time_ratio:>7.2f}x {memory_ratio:>7.2f}x"
+            f"{'  <-- regression' if regressed else ''}"
+        )
+    for key in sorted(set(before) ^ set(after)):
+        print(
+            f"{key[0]:>8} {key[1]:<50} only in {'before' if key in before else 'after'}"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+A deterministic synthetic dataset for benchmarking. The same size and seed always produce the same rows, so timings
+taken on different commits are measured against identical data
+"""
+import random
+from datetime import date, timedelta
+from typing import Dict, List
+
+from sqlalchemy.orm import Session
+
+from app.models import (
+    Candidate,
+    CandidatePromotionSummary,
+    Application,
+    Role,
+    Grade,
+    Organisation,
+    Location,
+    Profession,
+    Ethnicity,
+    Gender,
+    Sexuality,
+    Belief,
+    AgeRange,
+    WorkingPattern,
+    MainJobType,
+    Promotion,
+)
+from app import search
+from modules.seed import generate_random_fixed_data
+
+INTAKE_YEARS = [2017, 2018, 2019, 2020]
+CHUNK_SIZE = 5000
+
+
+def reference_ids(session: Session) -> Dict[str, List[int]]:
+    def ids(model):
+        return [row.id for row in session.query(model.id).order_by(model.id)]
+
+    promotions = {row.value: row.id for row in session.query(Promotion)}
+    return {
+        "organisation": ids(Organisation),
+        "location": ids(Location),
+        "profession": ids(Profession),
+        "ethnicity": ids(Ethnicity),
+        "gender": ids(Gender),
+        "sexuality": ids(Sexuality),
+        "belief": ids(Belief),
+        "age_range": ids(AgeRange),
+        "working_pattern": ids(WorkingPattern),
+        "main_job_type": ids(MainJobType),
+        # role changes, weighted so that level transfers are the most common and demotions the rarest
+        "role_change": [
+            promotions["substantive"],
+            promotions["temporary"],
+            promotions["level transfer"],
+            promotions["demotion"],
+        ],
+        # most junior first
+        "grade": [
+            row.id for row in session.query(Grade.id).order_by(Grade.rank.desc())
+        ],
+    }
+
+
+def candidate_row(generator: random.Random, candidate_id: int, ids: Dict) -> Dict:
+    def yes_no_or_no_answer():
+        return generator.choice([True, False, False, None])
+
+    return {
+        "id": candidate_id,
+        "first_name": f"First{candidate_id}",
+        "last_name": f"Last{candidate_id}",
+        "email_address": f"candidate.{candidate_id}@example.gov.uk",
+        "joining_date": date(generator.randrange(1990, 2016), 9, 1),
+        "joining_grade_id": generator.choice(ids["grade"][:6]),
+        "completed_fast_stream": generator.choice([True, False]),
+        "caring_responsibility": yes_no_or_no_answer(),
+        "long_term_health_condition": yes_no_or_no_answer(),
+        "age_range_id": generator.choice(ids["age_range"]),
+        "working_pattern_id": generator.choice(ids["working_pattern"]),
+        "belief_id": generator.choice(ids["belief"]),
+        "sexuality_id": generator.choice(ids["sexuality"]),
+        "gender_id": generator.choice(ids["gender"]),
+        "ethnicity_id": generator.choice(ids["ethnicity"]),
+        "main_job_type_id": generator.choice(ids["main_job_type"]),
+    }
+
+
+def application_rows(
+    generator: random.Random, candidate_id: int, next_id: int
+) -> List[Dict]:
+    """
+    Most candidates apply once; one in ten applied to the intake before as well
+    """
+    years = [generator.choice(INTAKE_YEARS)]
+    if generator.random() < 0.1 and years[0] > INTAKE_YEARS[0]:
+        years.insert(0, years[0] - 1)
+    return [
+        {
+            "id": next_id + number,
+            "candidate_id": candidate_id,
+            "scheme_id": generator.choice([1, 2]),
+            "application_date": date(year - 1, 6, 1),
+            "scheme_start_date": date(year, 3, 1),
+            "intake_year": year,
+            "successful": True,
+            "meta": generator.random() < 0.2,
+            "delta": generator.random() < 0.1,
+            "cohort": generator.randrange(1, 8),
+            "withdrawn": False,
+            "per_id": 100000 + candidate_id,
+            "employee_number": f"EMP{candidate_id:07d}",
+        }
+        for number, year in enumerate(years)
+    ]
+
+
+def role_rows(
+    generator: random.Random, candidate_id: int, next_id: int, ids: Dict
+) -> List[Dict]:
+    """
+    A career of one to six roles, each starting between four months and two and a half years after the last. Each
+    move is a promotion, a level transfer or a demotion, and the grade follows the move
+    """
+    substantive, temporary, level_transfer, demotion = ids["role_change"]
+    grade_index = generator.randrange(0, 5)
+    started = date(generator.randrange(2012, 2018), generator.randrange(1, 13), 1)
+    rows = []
+    for number in range(generator.randrange(1, 7)):
+        role_change_id = generator.choices(ids["role_change"], [3, 3, 5, 1])[0]
+        if number > 0:
+            if role_change_id in (substantive, temporary):
+                grade_index = min(grade_index + 1, len(ids["grade"]) - 1)
+            elif role_change_id == demotion:
+                grade_index = max(grade_index - 1, 0)
+        rows.append(
+            {
+                "id": next_id + number,
+                "candidate_id": candidate_id,
+                "date_started": started,
+                "role_name": f"Role {number}",
+                "organisation_id": generator.choice(ids["organisation"]),
+                "profession_id": generator.choice(ids["profession"]),
+                "location_id": generator.choice(ids["location"]),
+                "grade_id": ids["grade"][grade_index],
+                "role_change_id": role_change_id,
+            }
+        )
+        started += timedelta(days=generator.randrange(120, 900))
+    return rows
+
+
+def generate(session: Session, size: int, seed: int = 2019) -> None:
+    """
+    Fill an empty database with the reference data from `modules.seed` and `size` candidates, each with one or two
+    applications and a career history. Candidates, applications and roles are written with bulk inserts in chunks, so
+    a million candidates fit in memory
+    """
+    for reference_data in generate_random_fixed_data().values():
+        session.add_all(reference_data)
+    session.commit()
+
+    generator = random.Random(seed)
+    ids = reference_ids(session)
+    next_application_id = next_role_id = 1
+    for first_id in range(1, size + 1, CHUNK_SIZE):
+        candidates, applications, roles = [], [], []
+        for candidate_id in range(first_id, min(first_id + CHUNK_SIZE, size + 1)):
+            candidates.append(candidate_row(generator, candidate_id, ids))
+            applications.extend(
+                application_rows(generator, candidate_id, next_application_id)
+            )
+            next_application_id = applications[-1]["id"] + 1
+            roles.extend(role_rows(generator, candidate_id, next_role_id, ids))
+            next_role_id = roles[-1]["id"] + 1
+        session.execute(Candidate.__table__.insert(), candidates)
+        session.execute(Application.__table__.insert(), applications)
+        session.execute(Role.__table__.insert(), roles)
+        session.commit()
+    # bulk inserts skip the session events that keep the summaries, current pointers and search index up to date
+    CandidatePromotionSummary.refresh(session.connection())
+    Candidate.refresh_current(session.connection())
+    search.refresh(session.connection())
+    session.commit()
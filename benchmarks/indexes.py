@@ -0,0 +1,86 @@
+"""
+Measure what the composite indexes on Role and Application are worth. Every report is timed, and its query plans
+recorded, once with the indexes dropped and once with them in place:
+
+    python -m benchmarks.indexes --size 100000 --output-prefix indexes
+
+writes indexes-before.json and indexes-after.json, in the same format as `benchmarks.run`, and compares them with
+`benchmarks.compare`. The plans go in indexes-plans.json
+"""
+import json
+import sys
+
+from sqlalchemy import inspect
+
+from app.models import db, Role, Application
+from benchmarks import compare
+from benchmarks.query_plans import capture_statements, explain
+from benchmarks.run import (
+    argument_parser,
+    benchmark_app,
+    report_cases,
+    run_reports,
+    write_results,
+)
+
+COMPOSITE_INDEXES = [
+    index
+    for model in (Role, Application)
+    for index in model.__table__.indexes
+    if len(index.columns) > 1
+]
+
+
+def query_plans(options):
+    plans = {}
+    for name, build in report_cases(options.scheme, options.year):
+        if options.only and options.only not in name:
+            continue
+        plans[name] = [
+            {"statement": statement, "plan": explain(statement, parameters)}
+            for statement, parameters in capture_statements(build)
+        ]
+    return plans
+
+
+def main(arguments=None):
+    parser = argument_parser(__doc__.split("\n\n")[0])
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--output-prefix", default="indexes")
+    options = parser.parse_args(arguments)
+
+    app = benchmark_app(options, options.size)
+
+    plans = {}
+    with app.app_context():
+        for stage in ("before", "after"):
+            existing = {
+                index["name"]
+                for table in ("role", "application")
+                for index in inspect(db.engine).get_indexes(table)
+            }
+            for index in COMPOSITE_INDEXES:
+                if stage == "before" and index.name in existing:
+                    index.drop(db.engine)
+                elif stage == "after" and index.name not in existing:
+                    index.create(db.engine)
+            db.session.execute("ANALYZE")
+            db.session.commit()
+            print(f"== {stage}: {', '.join(index.name for index in COMPOSITE_INDEXES)}")
+            write_results(
+                f"{options.output_prefix}-{stage}.json",
+                run_reports(options.size, options),
+                options,
+                composite_indexes=stage == "after",
+            )
+            plans[stage] = query_plans(options)
+
+    with open(f"{options.output_prefix}-plans.json", "w") as output:
+        json.dump(plans, output, indent=2)
+    return compare.main(
+        [f"{options.output_prefix}-before.json", f"{options.output_prefix}-after.json"]
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Show the query plan of every statement each report runs, against a benchmark dataset. Use it to check that a change to
+a report's queries, or to the indexes, changes the plan the way it was meant to:
+
+    python -m benchmarks.query_plans --size 10000 --only detailed --output plans.json
+
+On SQLite the plans come from EXPLAIN QUERY PLAN; a full "SCAN" of a large table, where a "SEARCH ... USING INDEX" was
+expected, is the thing to look for. On Postgres they come from EXPLAIN
+"""
+import json
+from typing import Dict, List, Tuple
+
+from sqlalchemy import event
+
+from app.models import db
+from benchmarks.run import (
+    argument_parser,
+    benchmark_app,
+    consume,
+    report_cases,
+)
+
+
+def capture_statements(build) -> List[Tuple[str, object]]:
+    """
+    Run a report and return each distinct statement it sent to the database, with the parameters it was first sent with
+    """
+    statements: Dict[str, object] = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.setdefault(statement, parameters)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        consume(build())
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    return list(statements.items())
+
+
+def explain(statement: str, parameters) -> List[str]:
+    prefix = "EXPLAIN QUERY PLAN" if db.engine.dialect.name == "sqlite" else "EXPLAIN"
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"{prefix} {statement}", parameters)
+        return [" ".join(str(column) for column in row) for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def main(arguments=None):
+    parser = argument_parser(__doc__.split("\n\n")[0])
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--output", help="also write the plans to this JSON file")
+    options = parser.parse_args(arguments)
+
+    app = benchmark_app(options, options.size)
+
+    plans = {}
+    with app.app_context():
+        for name, build in report_cases(options.scheme, options.year):
+            if options.only and options.only not in name:
+                continue
+            plans[name] = [
+                {"statement": statement, "plan": explain(statement, parameters)}
+                for statement, parameters in capture_statements(build)
+            ]
+            print(f"== {name}")
+            for query in plans[name]:
+                print(" ".join(query["statement"].split())[:120])
+                for line in query["plan"]:
+                    print(f"    {line}")
+
+    if options.output:
+        with open(options.output, "w") as output:
+            json.dump({"size": options.size, "plans": plans}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
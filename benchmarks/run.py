@@ -0,0 +1,223 @@
+"""
+Time every report, and measure its peak memory, against synthetic datasets of increasing size. Results are written to
+a JSON file that `benchmarks.compare` can compare with the results from another commit.
+
+    python -m benchmarks.run --sizes 1000 10000 --output before.json
+    python -m benchmarks.run --sizes 1000 10000 --output after.json
+    python -m benchmarks.compare before.json after.json
+
+Each size gets its own SQLite file in --data-dir, which is kept and reused by later runs unless --regenerate is
+passed. Pass --database-url with a `{size}` placeholder to benchmark against another database, such as Postgres
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import sqlalchemy
+
+from app import create_app
+from app.models import db, Candidate, Promotion
+from benchmarks.dataset import generate
+from config import Config
+from reporting import ReportFactory, Report
+from reporting.detailed_report import DetailedReport
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+
+def benchmark_config(database_url: str, job_dir: str):
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+        REPORT_CACHE_TYPE = "null"
+        REPORT_JOB_EXECUTOR = "inline"
+        REPORT_JOB_DIR = job_dir
+
+    return BenchmarkConfig
+
+
+def report_parameters(report_type: str, attribute: str, scheme: str, year: int) -> dict:
+    parameters = {"scheme": scheme, "year": str(year), "attribute": attribute}
+    if report_type == "trends":
+        # the three intakes up to and including `year`
+        parameters.update(year=str(year - 2), final_year=str(year))
+    return parameters
+
+
+def report_cases(scheme: str, year: int) -> Iterator[Tuple[str, Callable[[], Report]]]:
+    """
+    Everything `ReportFactory.create_report` can build, then the detailed report for every kind of role change
+    """
+    for report_type, attributes in ReportFactory.reports().items():
+        for attribute in attributes:
+            parameters = report_parameters(report_type, attribute, scheme, year)
+            yield f"{report_type}:{attribute}", (
+                lambda report_type=report_type, parameters=parameters: (
+                    ReportFactory.create_report(report_type, **parameters)
+                )
+            )
+    for promotion in Promotion.query.order_by(Promotion.id):
+        yield f"detailed:{promotion.value}", (
+            lambda promotion_id=promotion.id: DetailedReport(year, scheme, promotion_id)
+        )
+
+
+def consume(report: Report) -> Tuple[int, int]:
+    """
+    Pull the whole CSV through the report's generator, the way a download would, without keeping it
+    """
+    rows = characters = 0
+    for chunk in report.generate_report_data():
+        rows += 1
+        characters += len(chunk)
+    return rows, characters
+
+
+def measure(build: Callable[[], Report], repeat: int) -> Dict:
+    timings = []
+    for _ in range(repeat):
+        db.session.remove()
+        start = time.perf_counter()
+        rows, characters = consume(build())
+        timings.append(time.perf_counter() - start)
+
+    db.session.remove()
+    tracemalloc.start()
+    consume(build())
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": statistics.median(timings),
+        "timings": timings,
+        "peak_memory_bytes": peak_memory,
+        "rows": rows,
+        "characters": characters,
+    }
+
+
+def prepare_database(app, size: int, seed: int, regenerate: bool) -> None:
+    with app.app_context():
+        if regenerate:
+            db.drop_all()
+        db.create_all()
+        if db.session.query(Candidate.id).first() is None:
+            print(f"Generating {size} candidates...")
+            generate(db.session, size, seed)
+
+
+def commit_hash() -> str:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def database_url_for(options, size: int) -> str:
+    if options.database_url:
+        return options.database_url.format(size=size)
+    path = os.path.join(options.data_dir, f"benchmark-{size}-{options.seed}.sqlite")
+    return f"sqlite:///{path}"
+
+
+def benchmark_app(options, size: int):
+    """
+    An app on the benchmark database for `size` candidates, generating the dataset first if it isn't there yet
+    """
+    os.makedirs(options.data_dir, exist_ok=True)
+    app = create_app(
+        benchmark_config(database_url_for(options, size), options.data_dir)
+    )
+    prepare_database(app, size, options.seed, options.regenerate)
+    return app
+
+
+def run_reports(size: int, options) -> List[Dict]:
+    """
+    Measure every report against the dataset of `size` candidates. Must be called inside its application context
+    """
+    results = []
+    for name, build in report_cases(options.scheme, options.year):
+        if options.only and options.only not in name:
+            continue
+        result = {"size": size, "report": name, **measure(build, options.repeat)}
+        results.append(result)
+        print(
+            f"{size:>8} {name:<50} {result['seconds']:>9.3f}s "
+            f"{result['peak_memory_bytes'] / 1024 / 1024:>9.1f}MiB"
+        )
+    return results
+
+
+def write_results(path: str, results: List[Dict], options, **metadata) -> None:
+    with open(path, "w") as output:
+        json.dump(
+            {
+                "metadata": {
+                    "commit": commit_hash(),
+                    "generated": datetime.now().isoformat(),
+                    "python": platform.python_version(),
+                    "sqlalchemy": sqlalchemy.__version__,
+                    "seed": options.seed,
+                    "scheme": options.scheme,
+                    "year": options.year,
+                    "repeat": options.repeat,
+                    **metadata,
+                },
+                "results": results,
+            },
+            output,
+            indent=2,
+        )
+    print(f"Results written to {path}")
+
+
+def argument_parser(description: str) -> argparse.ArgumentParser:
+    """
+    The options shared by every benchmark script
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join(tempfile.gettempdir(), "talent-tracker-benchmarks"),
+    )
+    parser.add_argument(
+        "--database-url", help="for example postgresql://localhost/benchmark_{size}"
+    )
+    parser.add_argument("--seed", type=int, default=2019)
+    parser.add_argument("--scheme", default="FLS")
+    parser.add_argument("--year", type=int, default=2019)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="only run reports whose name contains this")
+    parser.add_argument("--regenerate", action="store_true")
+    return parser
+
+
+def main(arguments=None):
+    parser = argument_parser(__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--output", default="benchmark-results.json")
+    options = parser.parse_args(arguments)
+
+    results = []
+    for size in options.sizes:
+        app = benchmark_app(options, size)
+        with app.app_context():
+            results.extend(run_reports(size, options))
+    write_results(options.output, results, options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Time candidate searches, the way the typeahead makes them, against a synthetic dataset:
+
+    python -m benchmarks.search --size 100000 --output search.json
+
+Each search is run --repeat times after one warm-up run. The results are in the same format as `benchmarks.run`, so two
+runs can be compared with `benchmarks.compare`. A dataset generated before the search index existed has it built first
+"""
+import statistics
+import time
+import tracemalloc
+
+from app.models import db
+from app.search import SEARCH_TABLE, refresh, search
+from benchmarks.run import (
+    argument_parser,
+    benchmark_app,
+    write_results,
+)
+
+# the dataset's candidates are called FirstN LastN, with email addresses candidate.N@example.gov.uk and employee
+# numbers EMP000000N
+SEARCHES = {
+    "name prefix": "First4242",
+    "full name": "first4242 last4242",
+    "email": "candidate.777@example",
+    "employee number": "EMP0012345",
+    "per id": "112345",
+    "typo": "Frist4242",
+    "matches everyone": "last",
+    "no match": "zzzz",
+}
+
+
+def main(arguments=None):
+    parser = argument_parser(__doc__.split("\n\n")[0])
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--output", default="search-results.json")
+    options = parser.parse_args(arguments)
+    options.repeat = max(options.repeat, 20)
+
+    app = benchmark_app(options, options.size)
+
+    results = []
+    with app.test_request_context():
+        if db.session.execute(f"SELECT count(*) FROM {SEARCH_TABLE}").scalar() == 0:
+            print("Building the search index...")
+            refresh(db.session.connection())
+            db.session.commit()
+        for name, query in SEARCHES.items():
+            if options.only and options.only not in name:
+                continue
+            found = len(search(query, options.limit))
+            timings = []
+            for _ in range(options.repeat):
+                start = time.perf_counter()
+                search(query, options.limit)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            tracemalloc.start()
+            search(query, options.limit)
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result = {
+                "report": f"search:{name}",
+                "size": options.size,
+                "seconds": statistics.median(timings),
+                "timings": timings,
+                "peak_memory_bytes": peak_memory,
+                "rows": found,
+            }
+            print(
+                f"{name:<20} {result['seconds'] * 1000:7.2f} ms median, "
+                f"{timings[int(len(timings) * 0.95) - 1] * 1000:7.2f} ms p95, {found} found"
+            )
+            results.append(result)
+    write_results(options.output, results, options, size=options.size)
+
+
+if __name__ == "__main__":
+    main()
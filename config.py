@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -6,12 +7,74 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    # read-only pages and reports use this replica when it's set. See app.replicas
+    SQLALCHEMY_REPLICA_URI = os.environ.get('REPLICA_DATABASE_URL')
+    # seconds after a user changes something during which their reads stay on the primary
+    REPLICA_READ_YOUR_WRITES = int(os.environ.get('REPLICA_READ_YOUR_WRITES', 10))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # pool and statement timeout settings for each kind of database work, with timeouts in seconds. See app.engines
+    SQLALCHEMY_ENGINE_PROFILES = {
+        'interactive': {
+            'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', 10)),
+            'pool_timeout': 10,
+            'pool_recycle': 30 * 60,
+            'pool_pre_ping': True,
+            'statement_timeout': int(os.environ.get('DATABASE_STATEMENT_TIMEOUT', 30)),
+        },
+        # each report job holds one connection, for one report at a time
+        'reporting': {
+            'pool_size': 1,
+            'max_overflow': 1,
+            'pool_timeout': 60,
+            'pool_recycle': 30 * 60,
+            'pool_pre_ping': True,
+            'statement_timeout': int(os.environ.get('REPORT_STATEMENT_TIMEOUT', 10 * 60)),
+        },
+        # flask commands such as seed and the rebuilds, which rewrite whole tables in one statement, so have no timeout
+        'maintenance': {
+            'pool_size': 1,
+            'max_overflow': 0,
+            'pool_recycle': 30 * 60,
+            'pool_pre_ping': True,
+        },
+    }
     ADMINS = ['your-email@example.com']
     LANGUAGES = ['en', 'es']
+    # "filesystem" is shared by every worker on a host, "simple" is per process and "null" switches caching off
+    REPORT_CACHE_TYPE = os.environ.get('REPORT_CACHE_TYPE', 'filesystem')
+    REPORT_CACHE_DIR = os.environ.get(
+        'REPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'talent-tracker-reports')
+    )
+    REPORT_CACHE_TTL = int(os.environ.get('REPORT_CACHE_TTL', 24 * 60 * 60))
+    REPORT_CACHE_MAX_ENTRIES = int(os.environ.get('REPORT_CACHE_MAX_ENTRIES', 256))
+    # "pool" runs reports in local processes, "worker" leaves them for `flask report-worker`
+    REPORT_JOB_EXECUTOR = os.environ.get('REPORT_JOB_EXECUTOR', 'pool')
+    REPORT_JOB_WORKERS = int(os.environ.get('REPORT_JOB_WORKERS', 2))
+    # seconds after which a report that's still running is taken to have lost its worker, and failed
+    REPORT_JOB_TIMEOUT = int(os.environ.get('REPORT_JOB_TIMEOUT', 60 * 60))
+    REPORT_JOB_DIR = os.environ.get(
+        'REPORT_JOB_DIR', os.path.join(tempfile.gettempdir(), 'talent-tracker-report-jobs')
+    )
+    # candidates on each page of /results, unless the page-size parameter asks for a different number up to the maximum
+    RESULTS_PAGE_SIZE = int(os.environ.get('RESULTS_PAGE_SIZE', 50))
+    RESULTS_MAX_PAGE_SIZE = int(os.environ.get('RESULTS_MAX_PAGE_SIZE', 500))
+    # how much of a search's trigrams a candidate must share to match it when nothing contains the search. See app.search
+    SEARCH_SIMILARITY_THRESHOLD = float(os.environ.get('SEARCH_SIMILARITY_THRESHOLD', 0.5))
+    SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', 50))
+    # seconds before a reference table, such as Grade or Promotion, is reloaded in case another process changed it
+    LOOKUP_TTL = int(os.environ.get('LOOKUP_TTL', 300))
+    # adds query counts and database time to every response, and logs them
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', 'true').lower() == 'true'
+    SQL_INSTRUMENTATION_LOG_LEVEL = os.environ.get('SQL_INSTRUMENTATION_LOG_LEVEL', 'INFO')
 
 
 class TestConfig(Config):
     SECRET_KEY = 'secret-testing-key'
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///testing-database'
+    REPORT_CACHE_TYPE = 'null'
+    REPORT_JOB_EXECUTOR = 'inline'
+    # reports run inside each test's transaction, so they can't have a connection of their own
+    SQLALCHEMY_ENGINE_PROFILES = {'interactive': Config.SQLALCHEMY_ENGINE_PROFILES['interactive']}
+    REPORT_JOB_DIR = os.path.join(tempfile.gettempdir(), 'talent-tracker-test-report-jobs')
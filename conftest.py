@@ -4,6 +4,7 @@ from app import create_app
 from app.models import db as _db
 from config import TestConfig
 from app.models import *
+from app.lookups import lookups
 from modules.seed import clear_old_data, commit_data
 
 
@@ -63,6 +64,8 @@ def test_session(db):
     transaction.rollback()
     connection.close()
     session_.remove()
+    # the rollback bypasses the session, so the lookup tables can't see it
+    lookups.invalidate()
 
 
 @pytest.fixture
@@ -407,6 +407,7 @@ def commit_data():
 
 def clear_old_data():
     tables = [
+        CandidatePromotionSummary,
         Application,
         Role,
         Candidate,
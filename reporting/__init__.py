@@ -1,15 +1,24 @@
+from typing import Dict, Type
+
 from reporting.base_report import Report
 from reporting.promotion_reports import (
     CharacteristicPromotionReport,
     BooleanCharacteristicPromotionReport,
     DeltaOfferPromotionReport,
     MetaOfferPromotionReport,
+    AllCharacteristicsPromotionReport,
+    CohortTrendReport,
 )
+from reporting.time_to_promotion_report import TimeToPromotionReport
+from reporting.survival_report import PromotionSurvivalReport
 
 
 class ReportFactory:
     @staticmethod
-    def create_report(report_type: str, **kwargs) -> Report:
+    def reports() -> Dict[str, Dict[str, Type[Report]]]:
+        """
+        Every report the factory can build, by report type and then attribute
+        """
 
         characteristic_reports = {
             key: CharacteristicPromotionReport
@@ -34,10 +43,32 @@ class ReportFactory:
             **characteristic_reports,
             **boolean_reports,
             **offer_reports,
+            "all": AllCharacteristicsPromotionReport,
+        }
+        trend_reports = {
+            key: CohortTrendReport
+            for key in [*characteristic_reports, *boolean_reports]
+        }
+        time_to_promotion_reports = {
+            key: TimeToPromotionReport
+            for key in [*characteristic_reports, *boolean_reports]
+        }
+        survival_reports = {
+            key: PromotionSurvivalReport
+            for key in [*characteristic_reports, *boolean_reports]
+        }
+        return {
+            "promotions": promotion_reports,
+            "trends": trend_reports,
+            "time-to-promotion": time_to_promotion_reports,
+            "survival": survival_reports,
         }
-        reports = {"promotions": promotion_reports}
 
-        report = reports.get(report_type).get(kwargs.get("attribute"))
+    @staticmethod
+    def create_report(report_type: str, **kwargs) -> Report:
+        report = (
+            ReportFactory.reports().get(report_type, {}).get(kwargs.get("attribute"))
+        )
         if not report:
             raise NotImplementedError("No such report type exists")
         else:
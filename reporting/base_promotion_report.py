@@ -2,9 +2,18 @@ from abc import ABC
 from datetime import date
 from typing import List
 
-from sqlalchemy import and_
+from sqlalchemy import and_, case, distinct, func
 
-from app.models import Candidate, Application, Scheme
+from app.loading import loader_profile
+from app.lookups import lookups
+from app.models import (
+    Candidate,
+    Application,
+    CandidatePromotionSummary,
+    Promotion,
+    Role,
+    db,
+)
 from reporting import Report
 
 
@@ -21,7 +30,6 @@ class PromotionReport(Report, ABC):
         self.intake_date = date(
             int(year), 3, 1
         )  # assuming it starts in March every year
-        self.scheme = Scheme.query.filter_by(name=f"{scheme}").first()
         # we only take credit for promotions that happen after candidates find out they're successful
         self.promotions_count_from = date(int(year) - 1, 12, 1)
 
@@ -63,13 +71,130 @@ class PromotionReport(Report, ABC):
         :return:
         :rtype:
         """
-        eligible_applications = Application.query.filter(
-            and_(
-                Application.scheme_start_date == self.intake_date,
-                Application.scheme_id == self.scheme.id,
+        return (
+            Candidate.query.options(*loader_profile("promotion_report"))
+            .join(Application, Application.candidate_id == Candidate.id)
+            .filter(self.eligibility_criteria())
+            .all()
+        )
+
+    def eligibility_criteria(self):
+        """
+        The filter on Application that defines this report's cohort. See `eligible_candidates`
+        """
+        return and_(
+            Application.scheme_start_date == self.intake_date,
+            Application.scheme_id == self.scheme.id,
+        )
+
+    def promoted_clause(self, temporary):
+        """
+        A clause that is true when the Candidate on the current row of a `cohort_query` was promoted in the period this
+        report covers. It asks the same question as `Candidate.promoted`, but of their promotion summary, so that every
+        candidate is answered in one statement
+        """
+        return CandidatePromotionSummary.promoted_between(
+            self.promotions_count_from, temporary=temporary
+        )
+
+    def promotion_counts(self, group_by):
+        """
+        Counts the eligible candidates, and those of them that were substantively and temporarily promoted, for each
+        value of `group_by` in a single aggregate query
+        :param group_by: a column on Candidate, for example Candidate.ethnicity_id
+        :return: a dictionary of value -> (number substantively promoted, number temporarily promoted, total)
+        :rtype: Dict
+        """
+        rows = (
+            self.cohort_query(group_by, *self.counted_columns())
+            .group_by(group_by)
+            .all()
+        )
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def first_promotions(self, kinds=("substantive", "temporary")):
+        """
+        Each eligible candidate's first promotion of each of `kinds` since promotions started counting, as a subquery
+        with a row per candidate and a column per kind. A column is NULL if the candidate hasn't had that kind
+        """
+        promotions = lookups.table(Promotion)
+
+        def first(kind):
+            role_change = promotions.containing(kind)
+            return func.min(
+                case(
+                    [
+                        (
+                            Role.role_change_id
+                            == (role_change.id if role_change else None),
+                            Role.date_started,
+                        )
+                    ]
+                )
+            ).label(kind)
+
+        return (
+            db.session.query(Role.candidate_id, *[first(kind) for kind in kinds])
+            .filter(
+                and_(
+                    Role.candidate_id.in_(
+                        db.session.query(Application.candidate_id).filter(
+                            self.eligibility_criteria()
+                        )
+                    ),
+                    Role.date_started >= self.promotions_count_from,
+                    Role.date_started <= date.today(),
+                )
             )
-        ).all()
-        return [application.candidate for application in eligible_applications]
+            .group_by(Role.candidate_id)
+            .subquery("first_promotions")
+        )
+
+    def cohort_query(self, *columns):
+        """
+        A query for `columns` over the eligible applications joined to their candidates and promotion summaries
+        """
+        return (
+            db.session.query(*columns)
+            .select_from(Application)
+            .join(Candidate, Application.candidate_id == Candidate.id)
+            .outerjoin(
+                CandidatePromotionSummary,
+                CandidatePromotionSummary.candidate_id == Candidate.id,
+            )
+            .filter(self.eligibility_criteria())
+        )
+
+    def counted_columns(self):
+        """
+        Aggregates for a grouped `cohort_query`: the number substantively promoted, the number temporarily promoted,
+        and the total. Candidates are counted rather than applications, so that someone with two applications to the
+        intake is counted once, as they are in `eligible_candidates`
+        """
+        return [
+            func.count(
+                distinct(case([(self.promoted_clause(temporary=False), Candidate.id)]))
+            ),
+            func.count(
+                distinct(case([(self.promoted_clause(temporary=True), Candidate.id)]))
+            ),
+            func.count(distinct(Candidate.id)),
+        ]
+
+    def row_from_counts(self, row_header, counts):
+        """
+        The set-based equivalent of `row_writer`, for a row whose numbers have already been counted by
+        `promotion_counts`
+        """
+        substantive, temporary, total = counts
+        return [
+            row_header,
+            substantive,
+            self.decimal_or_none(substantive, total),
+            temporary,
+            self.decimal_or_none(temporary, total),
+            total,
+        ]
 
     def promoted_candidates(self, temporary, candidates: List[Candidate]):
         return [
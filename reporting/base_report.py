@@ -5,6 +5,7 @@ from io import StringIO
 from flask import Response, stream_with_context
 from werkzeug.datastructures import Headers
 
+from app.lookups import lookups
 from app.models import Scheme
 
 
@@ -15,7 +16,7 @@ class Report(ABC):
     """
 
     def __init__(self, scheme: str):
-        self.scheme: Scheme = Scheme.query.filter_by(name=f"{scheme}").first()
+        self.scheme = lookups.table(Scheme).find(f"{scheme}")
         self.filename = None
         self.headers = []
 
@@ -38,8 +39,15 @@ class Report(ABC):
     def get_data(self):
         raise NotImplementedError
 
+    def iter_data(self):
+        """
+        The rows of the report, one at a time. By default this is `get_data`, which builds every row before the first
+        one is written. Reports over large cohorts should override this with a generator so that each row is sent as
+        soon as it's produced
+        """
+        return iter(self.get_data())
+
     def generate_report_data(self):
-        output = self.get_data()
         data = StringIO()
         w = csv.writer(data)
 
@@ -49,18 +57,26 @@ class Report(ABC):
         data.truncate(0)
 
         # write each item
-        for item in output:
+        for item in self.iter_data():
             yield self.write_row(item, data, w)
             data.seek(0)
             data.truncate(0)
 
+    def to_csv(self) -> str:
+        """
+        The whole report as one string, for when it needs to be stored rather than streamed
+        """
+        return "".join(self.generate_report_data())
+
     def return_data(self):
+        return self.csv_response(
+            stream_with_context(self.generate_report_data()), self.filename
+        )
+
+    @staticmethod
+    def csv_response(body, filename: str) -> Response:
         headers = Headers()
-        headers["Content-Disposition"] = f"attachment; filename={self.filename}.csv"
+        headers["Content-Disposition"] = f"attachment; filename={filename}.csv"
         headers["Content-type"] = "text/csv"
 
-        return Response(
-            stream_with_context(self.generate_report_data()),
-            mimetype="text/csv",
-            headers=headers,
-        )
+        return Response(body, mimetype="text/csv", headers=headers)
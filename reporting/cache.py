@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import date
+from itertools import chain
+from threading import Lock
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models import Candidate, Role, Application, ReportDataVersion, db
+
+# Reports are built from these tables, so any change to them makes every cached report stale
+WATCHED_MODELS = (Candidate, Role, Application)
+
+
+class NullBackend:
+    """
+    Caches nothing. Used when caching is switched off, and in tests
+    """
+
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value) -> None:
+        pass
+
+
+class MemoryBackend:
+    """
+    A least-recently-used cache, local to one process. Entries also expire `ttl` seconds after they're written
+    """
+
+    def __init__(self, max_entries: int = 128, ttl: int = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskBackend:
+    """
+    A cache shared by every worker on a host. Each entry is a JSON file in `directory`, written to a temporary file
+    and then moved into place so that readers never see half an entry. A file's modification time records when it was
+    last read, and when there are more than `max_entries` files the least recently used are deleted
+    """
+
+    def __init__(self, directory: str, max_entries: int = 256, ttl: int = 3600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path) as entry_file:
+                entry = json.load(entry_file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if entry["expires_at"] < time.time():
+            self._remove(path)
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value) -> None:
+        handle, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, "w") as entry_file:
+            json.dump(
+                {"expires_at": time.time() + self.ttl, "value": value}, entry_file
+            )
+        os.replace(temporary_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        paths = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".json")
+        ]
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=self._last_used)
+        for path in paths[: len(paths) - self.max_entries]:
+            self._remove(path)
+
+    @staticmethod
+    def _last_used(path: str) -> float:
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class ReportCache:
+    """
+    Sits in front of report generation. Entries are keyed by the report type, its parameters, the day it's run on, and
+    a data version that changes whenever a Candidate, Role or Application is written. Changing the data therefore
+    invalidates every cached report at once, without having to work out which reports it affected.
+
+    The data version is the `report_data_version` row in the database, so every process sees the same version whichever
+    backend it caches in. Session writes bump it, including bulk updates and deletes through a query. Writes that
+    bypass the session's unit of work, with `bulk_save_objects`, `bulk_insert_mappings`, Core statements or raw SQL,
+    don't, and must call `bump_data_version` on their connection themselves.
+    """
+
+    backends = {"null", "simple", "filesystem"}
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("REPORT_CACHE_TYPE", "null")
+        app.config.setdefault("REPORT_CACHE_MAX_ENTRIES", 256)
+        app.config.setdefault("REPORT_CACHE_TTL", 3600)
+        cache_type = app.config["REPORT_CACHE_TYPE"]
+        if cache_type == "filesystem":
+            backend = DiskBackend(
+                app.config["REPORT_CACHE_DIR"],
+                max_entries=app.config["REPORT_CACHE_MAX_ENTRIES"],
+                ttl=app.config["REPORT_CACHE_TTL"],
+            )
+        elif cache_type == "simple":
+            backend = MemoryBackend(
+                max_entries=app.config["REPORT_CACHE_MAX_ENTRIES"],
+                ttl=app.config["REPORT_CACHE_TTL"],
+            )
+        elif cache_type == "null":
+            backend = NullBackend()
+        else:
+            raise ValueError(f"REPORT_CACHE_TYPE must be one of {self.backends}")
+        app.extensions["report_cache"] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions["report_cache"]
+
+    @staticmethod
+    def data_version() -> str:
+        """
+        Read through the session, so a report built from the read replica is keyed by the version the replica has
+        reached rather than the primary's
+        """
+        version = (
+            db.session.query(ReportDataVersion.version)
+            .filter(ReportDataVersion.id == 1)
+            .scalar()
+        )
+        return str(version or 0)
+
+    @staticmethod
+    def bump_data_version(connection) -> None:
+        """
+        Count a change to the report data, in the transaction on `connection` that made it. The row stays locked until
+        that transaction ends, so concurrent writers bump it one after another
+        """
+        table = ReportDataVersion.__table__
+        bumped = connection.execute(
+            table.update().where(table.c.id == 1).values(version=table.c.version + 1)
+        )
+        if bumped.rowcount == 0:
+            connection.execute(table.insert().values(id=1, version=1))
+
+    def key(self, report_type: str, parameters: Dict) -> str:
+        key_data = [
+            report_type,
+            sorted((str(name), str(value)) for name, value in parameters.items()),
+            date.today().isoformat(),
+            self.data_version(),
+        ]
+        return hashlib.sha256(json.dumps(key_data).encode("utf-8")).hexdigest()
+
+    def get_or_create(
+        self,
+        report_type: str,
+        parameters: Dict,
+        create: Callable[[], Tuple[str, str]],
+    ) -> Tuple[str, str]:
+        """
+        Return the cached (filename, csv) pair for this report, calling `create` to build it if there isn't one
+        """
+        key = self.key(report_type, parameters)
+        cached: Optional[list] = self.backend.get(key)
+        if cached is not None:
+            return cached[0], cached[1]
+        filename, body = create()
+        self.backend.set(key, [filename, body])
+        return filename, body
+
+
+report_cache = ReportCache()
+
+
+def note_report_data_change(session) -> None:
+    """
+    Bump the data version once in each transaction that changes report data
+    """
+    if not session.info.get("report_data_changed"):
+        report_cache.bump_data_version(session.connection())
+        session.info["report_data_changed"] = True
+
+
+@event.listens_for(Session, "after_flush")
+def note_report_data_changes(session, flush_context):
+    if any(
+        isinstance(instance, WATCHED_MODELS)
+        for instance in chain(session.new, session.dirty, session.deleted)
+    ):
+        note_report_data_change(session)
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def note_bulk_report_data_changes(context):
+    if context.mapper.class_ in WATCHED_MODELS:
+        note_report_data_change(context.session)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def forget_report_data_changes(session):
+    session.info.pop("report_data_changed", None)
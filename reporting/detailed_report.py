@@ -1,19 +1,28 @@
 from reporting.base_report import Report
-from typing import List
+from typing import List, Iterator, Iterable
+from app.loading import loader_profile
+from app.lookups import lookups
 from app.models import Candidate, Application, Promotion, Role
-from sqlalchemy import and_, extract
+from sqlalchemy import and_
 from datetime import datetime, date
+from itertools import islice
 
 
 class DetailedReport(Report):
     """
-    The initial version of the detailed report will take one input year, one scheme, and one role_change_type
+    The initial version of the detailed report will take one input year, one scheme, and one role_change_type.
+
+    Candidates are read in batches of `batch_size`. Their characteristics are joined onto the query that reads them,
+    which also checks their role changes, and each batch's current roles and latest applications are looked up in one
+    query, so the number of queries depends on the number of batches rather than the number of candidates
     """
 
+    batch_size = 500
+
     def __init__(self, intake_year: str, scheme: str, role_change_type: int):
         super().__init__(scheme)
         self.intake = int(intake_year)
-        self.role_change_type: Promotion = Promotion.query.get(role_change_type)
+        self.role_change_type = lookups.table(Promotion).get(role_change_type)
         self.filename = (
             f"detailed-report-{self.intake}-{self.role_change_type.value}-{scheme}"
         )
@@ -44,13 +53,12 @@ class DetailedReport(Report):
         ]
 
     def write_row(self, row_data, data_object, csv_writer):
-        print(row_data)
         csv_writer.writerow(row_data)
         return data_object.getvalue()
 
-    def row_writer(self, candidate: Candidate) -> List:
-        application = candidate.most_recent_application()
-        current_role: Role = candidate.roles[0]
+    def row_writer(
+        self, candidate: Candidate, application: Application, current_role: Role
+    ) -> List:
         return [
             f"{candidate.first_name} {candidate.last_name}",
             candidate.email_address,
@@ -77,40 +85,51 @@ class DetailedReport(Report):
         ]
 
     def get_data(self):
-        output = []
-        for candidate in self.candidates():
-            output.append(self.row_writer(candidate))
-        return output
+        return list(self.iter_data())
+
+    def iter_data(self):
+        for batch in self.batches(self.candidates()):
+            states = Candidate.current_state_for(candidate.id for candidate in batch)
+            for candidate in batch:
+                state = states.get(candidate.id)
+                yield self.row_writer(candidate, state.application, state.role)
 
-    def candidates(self):
+    def batches(self, candidates: Iterable[Candidate]) -> Iterator[List[Candidate]]:
+        candidates = iter(candidates)
+        batch = list(islice(candidates, self.batch_size))
+        while batch:
+            yield batch
+            batch = list(islice(candidates, self.batch_size))
+
+    def candidates(self) -> Iterator[Candidate]:
         """
-        Iterate through the roles each candidate has held since beginning the programme and identifies if any of them
-        have been 'role_change_type'. If they have, return that candidate
+        Identify which of the eligible candidates have held a role of type 'role_change_type' since beginning the
+        programme, and yield those candidates. The role changes are checked by the same query that reads the
+        candidates, as a semi-join
         :return:
         :rtype:
         """
-        return [
-            candidate
-            for candidate in self.eligible_candidates()
-            if self.role_change_type
-            in {
-                role.role_change
-                for role in candidate.roles_since_date(date(self.intake, 1, 1))
-            }
-        ]
+        return self.eligible_candidates().filter(
+            Candidate.had_role_change_since(
+                self.role_change_type.id, date(self.intake, 1, 1)
+            )
+        )
 
-    def eligible_candidates(self) -> List[Candidate]:
+    def eligible_candidates(self) -> Iterator[Candidate]:
         """
-        Eligible candidates are those in `intake` and on `scheme`. The year in the application start date is used as
-        shorthand for the intake year
-        :return: List[Candidate]
+        Eligible candidates are those in `intake` and on `scheme`. Candidates are streamed from a server-side cursor
+        `batch_size` at a time, so memory use doesn't grow with the size of the cohort
+        :return: Iterator[Candidate]
         """
-        return [
-            application.candidate
-            for application in Application.query.filter(
+        return (
+            Candidate.query.options(*loader_profile("detailed_report"))
+            .join(Application, Application.candidate_id == Candidate.id)
+            .filter(
                 and_(
-                    extract("year", Application.scheme_start_date) == self.intake,
+                    Application.intake_year == self.intake,
                     Application.scheme_id == self.scheme.id,
                 )
-            ).all()
-        ]
+            )
+            .execution_options(stream_results=True)
+            .yield_per(self.batch_size)
+        )
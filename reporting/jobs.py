@@ -0,0 +1,393 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, NamedTuple, Optional
+
+from flask import current_app
+
+from app import create_app
+from app.engines import engine_profiles
+from app.replicas import replica_routing
+from reporting import ReportFactory, Report
+from reporting.cache import report_cache
+from reporting.detailed_report import DetailedReport
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETE = "complete"
+FAILED = "failed"
+
+REPORTING = "reporting"
+
+
+class ReportJob(NamedTuple):
+    id: str
+    report_type: str
+    parameters: Dict
+    status: str
+    filename: Optional[str]
+    error: Optional[str]
+    created_at: float
+    updated_at: float
+    # until when the report must be read from the primary, because the user who asked for it has just changed something
+    primary_reads_until: Optional[float]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (COMPLETE, FAILED)
+
+
+class JobStore:
+    """
+    The queue of report jobs. It's a SQLite file next to the finished reports, so the web workers and any report
+    workers on the same host can share it without a separate broker.
+
+    A job still running `timeout` seconds after it was claimed is taken to have lost its worker, and is failed the next
+    time it's looked at or another job is claimed
+    """
+
+    def __init__(self, directory: str, timeout: Optional[float] = None):
+        self.directory = directory
+        self.timeout = timeout
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "jobs.sqlite3")
+        with self._connect() as connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS report_job (
+                    id TEXT PRIMARY KEY,
+                    report_type TEXT NOT NULL,
+                    parameters TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    filename TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    primary_reads_until REAL
+                )
+                """
+            )
+            columns = {
+                row["name"]
+                for row in connection.execute("PRAGMA table_info(report_job)")
+            }
+            if "primary_reads_until" not in columns:
+                connection.execute(
+                    "ALTER TABLE report_job ADD COLUMN primary_reads_until REAL"
+                )
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _job(row) -> Optional[ReportJob]:
+        if row is None:
+            return None
+        return ReportJob(**{**dict(row), "parameters": json.loads(row["parameters"])})
+
+    def output_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.csv")
+
+    def enqueue(
+        self, report_type: str, parameters: Dict, primary_reads_until: float = None
+    ) -> ReportJob:
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO report_job "
+                "(id, report_type, parameters, status, created_at, updated_at, primary_reads_until) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    report_type,
+                    json.dumps(parameters),
+                    QUEUED,
+                    now,
+                    now,
+                    primary_reads_until,
+                ),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        with self._connect() as connection:
+            job = self._job(
+                connection.execute(
+                    "SELECT * FROM report_job WHERE id = ?", (job_id,)
+                ).fetchone()
+            )
+        if job and job.status == RUNNING and self._abandoned_before() > job.updated_at:
+            with self._connect() as connection:
+                self._fail_abandoned(connection)
+            return self.get(job_id)
+        return job
+
+    def _abandoned_before(self) -> float:
+        return time.time() - self.timeout if self.timeout else 0
+
+    def _fail_abandoned(self, connection) -> None:
+        if self.timeout:
+            connection.execute(
+                "UPDATE report_job SET status = ?, error = ?, updated_at = ? WHERE status = ? AND updated_at < ?",
+                (
+                    FAILED,
+                    "The report's worker stopped before it finished",
+                    time.time(),
+                    RUNNING,
+                    self._abandoned_before(),
+                ),
+            )
+
+    def claim(self, job_id: str = None) -> Optional[ReportJob]:
+        """
+        Mark a queued job as running and return it, or return None if there's nothing to do. Without `job_id` this
+        claims the oldest queued job. The write lock is taken before reading, so two workers can't claim the same job
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            self._fail_abandoned(connection)
+            if job_id:
+                row = connection.execute(
+                    "SELECT * FROM report_job WHERE id = ? AND status = ?",
+                    (job_id, QUEUED),
+                ).fetchone()
+            else:
+                row = connection.execute(
+                    "SELECT * FROM report_job WHERE status = ? ORDER BY created_at LIMIT 1",
+                    (QUEUED,),
+                ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE report_job SET status = ?, updated_at = ? WHERE id = ?",
+                    (RUNNING, time.time(), row["id"]),
+                )
+            connection.execute("COMMIT")
+        job = self._job(row)
+        return job._replace(status=RUNNING) if job else None
+
+    def finish(self, job_id: str, filename: str) -> None:
+        self._update(job_id, status=COMPLETE, filename=filename)
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._update(job_id, status=FAILED, error=error)
+
+    def _update(self, job_id: str, **values) -> None:
+        values["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        with self._connect() as connection:
+            connection.execute(
+                f"UPDATE report_job SET {assignments} WHERE id = ?",
+                (*values.values(), job_id),
+            )
+
+    def prune(self, older_than: float) -> None:
+        """
+        Delete finished jobs, and their reports, that were last updated more than `older_than` seconds ago
+        """
+        cutoff = time.time() - older_than
+        with self._connect() as connection:
+            expired = [
+                row["id"]
+                for row in connection.execute(
+                    "SELECT id FROM report_job WHERE status IN (?, ?) AND updated_at < ?",
+                    (COMPLETE, FAILED, cutoff),
+                )
+            ]
+            connection.executemany(
+                "DELETE FROM report_job WHERE id = ?", [(job_id,) for job_id in expired]
+            )
+        for job_id in expired:
+            try:
+                os.remove(self.output_path(job_id))
+            except OSError:
+                pass
+
+
+def build_report(report_type: str, parameters: Dict) -> Report:
+    if report_type == "detailed":
+        return DetailedReport(
+            parameters.get("year"),
+            parameters.get("scheme"),
+            parameters.get("promotion-type"),
+        )
+    return ReportFactory.create_report(report_type=report_type, **parameters)
+
+
+def write_report(job: ReportJob, output_path: str) -> str:
+    """
+    Build the job's report and write it to `output_path`, returning the report's filename. Promotion reports go through
+    the report cache; the detailed report is streamed straight to disk
+    """
+    if job.report_type == "detailed":
+        report = build_report(job.report_type, job.parameters)
+        with open(output_path, "w", newline="") as output:
+            output.writelines(report.generate_report_data())
+        return report.filename
+
+    def create():
+        report = build_report(job.report_type, job.parameters)
+        return report.filename, report.to_csv()
+
+    filename, body = report_cache.get_or_create(job.report_type, job.parameters, create)
+    with open(output_path, "w", newline="") as output:
+        output.write(body)
+    return filename
+
+
+def run_job(store: JobStore, job_id: str = None) -> Optional[ReportJob]:
+    """
+    Claim a job and write its CSV to the job directory. Must be called inside an application context. Reports only
+    read, so they're built from the read replica when there is one, through the reporting engine profile's pool. The
+    primary is used instead while the user who asked for the report could still be reading their own recent change,
+    even though the job runs away from their request. A report whose queries overrun the profile's statement timeout
+    fails rather than holding on to its connection
+    """
+    job = store.claim(job_id)
+    if job is None:
+        return None
+    try:
+        with replica_routing.reading(
+            job.primary_reads_until or 0
+        ), engine_profiles.workload(REPORTING):
+            filename = write_report(job, store.output_path(job.id))
+    except Exception as error:
+        current_app.logger.exception(f"Report job {job.id} failed")
+        store.fail(job.id, repr(error))
+    else:
+        store.finish(job.id, filename)
+    return store.get(job.id)
+
+
+_worker_app = None
+
+
+def _start_worker(configuration: str) -> None:
+    """
+    Build the pool process's app from the import path of the web app's configuration. The configuration reads the same
+    environment in both processes, and live objects such as engine options are made again rather than copied across
+    """
+    global _worker_app
+    _worker_app = create_app(configuration)
+
+
+def _run_in_worker(job_id: str) -> None:
+    with _worker_app.app_context():
+        run_job(ReportJobs.store_for(_worker_app), job_id)
+
+
+class ReportJobs:
+    """
+    Runs reports away from the request that asked for them. REPORT_JOB_EXECUTOR chooses how:
+
+    - "pool" runs jobs in a pool of local processes owned by the web worker
+    - "worker" leaves jobs in the queue for `flask report-worker` to pick up
+    - "inline" runs jobs straight away in the request, which is only sensible for tests
+    """
+
+    executors = {"pool", "worker", "inline"}
+
+    def __init__(self, app=None):
+        self._pools = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("REPORT_JOB_EXECUTOR", "pool")
+        app.config.setdefault("REPORT_JOB_WORKERS", 2)
+        app.config.setdefault("REPORT_JOB_RETENTION", 7 * 24 * 60 * 60)
+        app.config.setdefault("REPORT_JOB_TIMEOUT", 60 * 60)
+        if app.config["REPORT_JOB_EXECUTOR"] not in self.executors:
+            raise ValueError(f"REPORT_JOB_EXECUTOR must be one of {self.executors}")
+        app.extensions["report_jobs"] = JobStore(
+            app.config["REPORT_JOB_DIR"], timeout=app.config["REPORT_JOB_TIMEOUT"]
+        )
+
+    @staticmethod
+    def store_for(app) -> JobStore:
+        return app.extensions["report_jobs"]
+
+    @property
+    def store(self) -> JobStore:
+        return self.store_for(current_app)
+
+    def submit(self, report_type: str, parameters: Dict) -> ReportJob:
+        self.store.prune(current_app.config["REPORT_JOB_RETENTION"])
+        job = self.store.enqueue(
+            report_type, parameters, replica_routing.primary_reads_until()
+        )
+        executor = current_app.config["REPORT_JOB_EXECUTOR"]
+        if executor == "inline":
+            return run_job(self.store, job.id)
+        if executor == "pool":
+            try:
+                pool = self._pool()
+                future = pool.submit(_run_in_worker, job.id)
+            except Exception as error:
+                current_app.logger.exception(
+                    f"Report job {job.id} couldn't be handed to a worker"
+                )
+                self.store.fail(job.id, repr(error))
+                return self.store.get(job.id)
+            future.add_done_callback(
+                partial(self._job_done, current_app._get_current_object(), pool, job.id)
+            )
+        return job
+
+    def _pool(self) -> ProcessPoolExecutor:
+        app = current_app._get_current_object()
+        if app not in self._pools:
+            self._pools[app] = ProcessPoolExecutor(
+                max_workers=app.config["REPORT_JOB_WORKERS"],
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_start_worker,
+                initargs=(app.config["CONFIG_OBJECT"],),
+            )
+        return self._pools[app]
+
+    def _job_done(
+        self, app, pool: ProcessPoolExecutor, job_id: str, future: Future
+    ) -> None:
+        """
+        Called in the web worker once a pooled job's future is done. `run_job` records the report's own errors, so an
+        exception here means the pool process couldn't run the job at all, for example because it died
+        """
+        error = None if future.cancelled() else future.exception()
+        if error is None:
+            return
+        app.logger.error(f"Report job {job_id} was lost by its worker", exc_info=error)
+        # a broken pool refuses every job after this one, so the next job starts a new pool
+        if isinstance(error, BrokenProcessPool) and self._pools.get(app) is pool:
+            del self._pools[app]
+            pool.shutdown(wait=False)
+        store = self.store_for(app)
+        job = store.get(job_id)
+        if job and not job.finished:
+            store.fail(job_id, repr(error))
+
+    def work(self, poll_interval: float = 2, run_once: bool = False) -> None:
+        """
+        Run queued jobs one after another, for as long as the process lives. Used by `flask report-worker`
+        """
+        while True:
+            job = run_job(self.store)
+            if run_once:
+                return
+            if job is None:
+                time.sleep(poll_interval)
+
+
+report_jobs = ReportJobs()
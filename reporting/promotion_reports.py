@@ -1,4 +1,6 @@
+from app.lookups import lookups
 from app.models import (
+    Application,
     Ethnicity,
     Gender,
     Candidate,
@@ -9,6 +11,9 @@ from app.models import (
 )
 
 from reporting.base_promotion_report import PromotionReport
+from collections import defaultdict
+from datetime import date
+from sqlalchemy import and_, case
 
 
 class CharacteristicPromotionReport(PromotionReport):
@@ -17,29 +22,28 @@ class CharacteristicPromotionReport(PromotionReport):
     iterates over each value in the table and groups together candidates with that value
     """
 
+    tables = {
+        "ethnicity": Ethnicity,
+        "gender": Gender,
+        "sexuality": Sexuality,
+        "belief": Belief,
+        "working_pattern": WorkingPattern,
+        "age_range": AgeRange,
+    }
+
     def __init__(self, scheme: str, year: str, attribute: str):
         super().__init__(scheme, year, attribute)
-        self.tables = {
-            "ethnicity": Ethnicity,
-            "gender": Gender,
-            "sexuality": Sexuality,
-            "belief": Belief,
-            "working_pattern": WorkingPattern,
-            "age_range": AgeRange,
-        }
         self.table = self.tables.get(self.attribute)
 
-    def get_row_metadata(self):
-        return [
-            (row.value, self.candidates_with_characteristic(row))
-            for row in self.table.query.all()
-        ]
-
-    def candidates_with_characteristic(self, characteristic):
+    def get_data(self):
+        """
+        The whole table is counted in one aggregate query, grouped by the characteristic's foreign key on Candidate.
+        Values that no eligible candidate holds still get a row, full of zeroes
+        """
+        counts = self.promotion_counts(getattr(Candidate, f"{self.attribute}_id"))
         return [
-            candidate
-            for candidate in self.eligible_candidates()
-            if getattr(candidate, self.attribute) == characteristic
+            self.row_from_counts(row.value, counts.get(row.id, (0, 0, 0)))
+            for row in lookups.table(self.table)
         ]
 
 
@@ -48,36 +52,198 @@ class BooleanCharacteristicPromotionReport(PromotionReport):
     These reports are those where the corresponding database field is a boolean, rather than a distinct table.
     """
 
+    human_readable_characteristics = {
+        "long_term_health_condition": {
+            True: "People with a disability",
+            False: "People without a disability",
+            None: "No answer provided",
+        },
+        "caring_responsibility": {
+            True: "I have caring responsibilities",
+            False: "I do not have caring responsibilities",
+            None: "No answer provided",
+        },
+    }
+
     def __init__(self, scheme: str, year: str, attribute: str):
         super().__init__(scheme, year, attribute)
-        self.human_readable_characteristics = {
-            "long_term_health_condition": {
-                True: "People with a disability",
-                False: "People without a disability",
-                None: "No answer provided",
-            },
-            "caring_responsibility": {
-                True: "I have caring responsibilities",
-                False: "I do not have caring responsibilities",
-                None: "No answer provided",
-            },
-        }
         self.human_readable_row_titles = self.human_readable_characteristics.get(
             self.attribute
         )
 
-    def get_row_metadata(self):
+    def get_data(self):
+        """
+        The intake is counted in one aggregate query, grouped by the characteristic's True, False and NULL values
+        """
+        counts = self.promotion_counts(getattr(Candidate, self.attribute))
         return [
-            (
-                value,
-                Candidate.query.filter(
-                    getattr(Candidate, self.attribute).is_(key)
-                ).all(),
-            )
-            for key, value in self.human_readable_row_titles.items()
+            self.row_from_counts(title, counts.get(value, (0, 0, 0)))
+            for value, title in self.human_readable_row_titles.items()
         ]
 
 
+class AllCharacteristicsPromotionReport(PromotionReport):
+    """
+    Every characteristic breakdown for one intake, from a single pass over the cohort. The cohort is grouped by all
+    the characteristics at once and each breakdown is totalled from those groups, so no candidate is looked at twice.
+
+    The output has a section for each characteristic, with its own title and column headers. Those rows are tuples,
+    which `write_row` writes as they are; the rows of numbers are lists, and are formatted like any other promotion
+    report
+    """
+
+    section_titles = {
+        "ethnicity": "Ethnicity",
+        "gender": "Gender",
+        "sexuality": "Sexuality",
+        "belief": "Belief",
+        "working_pattern": "Working pattern",
+        "age_range": "Age range",
+        "long_term_health_condition": "Disability",
+        "caring_responsibility": "Caring responsibility",
+    }
+
+    def __init__(self, scheme: str, year: str, attribute: str = "all"):
+        super().__init__(scheme, year, attribute)
+        self.section_headers = tuple(self.headers)
+        self.headers = [f"Promotions by characteristic for the {scheme} {year} intake"]
+
+    @staticmethod
+    def grouping_column(attribute):
+        if attribute in CharacteristicPromotionReport.tables:
+            return getattr(Candidate, f"{attribute}_id")
+        return getattr(Candidate, attribute)
+
+    @staticmethod
+    def row_titles(attribute):
+        """
+        (value, row title) pairs for each row in `attribute`'s section, in the order the single-characteristic report
+        would list them
+        """
+        if attribute in CharacteristicPromotionReport.tables:
+            table = CharacteristicPromotionReport.tables.get(attribute)
+            return [(row.id, row.value) for row in lookups.table(table)]
+        return list(
+            BooleanCharacteristicPromotionReport.human_readable_characteristics.get(
+                attribute
+            ).items()
+        )
+
+    def get_data(self):
+        attributes = list(self.section_titles.keys())
+        columns = [self.grouping_column(attribute) for attribute in attributes]
+        totals = {attribute: defaultdict(lambda: [0, 0, 0]) for attribute in attributes}
+        for row in self.cohort_query(*columns, *self.counted_columns()).group_by(
+            *columns
+        ):
+            counts = row[-3:]
+            for attribute, value in zip(attributes, row):
+                for index, count in enumerate(counts):
+                    totals[attribute][value][index] += count
+
+        output = []
+        for attribute in attributes:
+            output.append(())
+            output.append((self.section_titles.get(attribute),))
+            output.append(self.section_headers)
+            output.extend(
+                self.row_from_counts(title, totals[attribute][value])
+                for value, title in self.row_titles(attribute)
+            )
+        return output
+
+    def write_row(self, row_data, data_object, csv_writer):
+        if isinstance(row_data, tuple):
+            csv_writer.writerow(row_data)
+            return data_object.getvalue()
+        return super().write_row(row_data, data_object, csv_writer)
+
+
+class CohortTrendReport(PromotionReport):
+    """
+    Promotions by one characteristic for a run of intakes, side by side: a row for each value of the characteristic
+    and a group of columns for each intake year. Every intake is counted in the same grouped query, with each row's
+    promotions counted from the December before its own intake
+    """
+
+    year_headers = [
+        "number substantively promoted",
+        "percentage substantively promoted",
+        "number temporarily promoted",
+        "percentage temporarily promoted",
+        "total in group",
+    ]
+
+    def __init__(self, scheme: str, year: str, attribute: str, final_year: str = None):
+        super().__init__(scheme, year, attribute)
+        self.years = list(range(int(year), int(final_year or year) + 1))
+        if not self.years:
+            raise ValueError("The final intake year can't be before the first")
+        self.promotions_count_from = case(
+            [
+                (
+                    Application.scheme_start_date == self.intake_start(year),
+                    date(year - 1, 12, 1),
+                )
+                for year in self.years
+            ]
+        )
+        self.headers = ["characteristic"]
+        for year in self.years:
+            self.headers.extend(f"{year} {header}" for header in self.year_headers)
+        self.filename = (
+            f"promotion-trends-by-{attribute}-{scheme}-{self.years[0]}-{self.years[-1]}"
+            f"-generated-{date.today().strftime('%d-%m-%Y')}"
+        )
+
+    @staticmethod
+    def intake_start(year: int) -> date:
+        return date(year, 3, 1)
+
+    def eligibility_criteria(self):
+        return and_(
+            Application.scheme_start_date.in_(
+                [self.intake_start(year) for year in self.years]
+            ),
+            Application.scheme_id == self.scheme.id,
+        )
+
+    def get_data(self):
+        column = AllCharacteristicsPromotionReport.grouping_column(self.attribute)
+        counts = {
+            (row[0].year, row[1]): row[2:]
+            for row in self.cohort_query(
+                Application.scheme_start_date, column, *self.counted_columns()
+            ).group_by(Application.scheme_start_date, column)
+        }
+        output = []
+        for value, title in AllCharacteristicsPromotionReport.row_titles(
+            self.attribute
+        ):
+            row = [title]
+            for year in self.years:
+                row.extend(
+                    self.row_from_counts(title, counts.get((year, value), (0, 0, 0)))[
+                        1:
+                    ]
+                )
+            output.append(row)
+        return output
+
+    def write_row(self, row_data, data_object, csv_writer):
+        """
+        Like `PromotionReport.write_row`, with the rates in every year's columns written as percentages
+        """
+        csv_writer.writerow(
+            [row_data[0]]
+            + [
+                "{0:.0%}".format(value) if index % 5 in (1, 3) else value
+                for index, value in enumerate(row_data[1:])
+            ]
+        )
+        return data_object.getvalue()
+
+
 class OfferPromotionReport(PromotionReport):
     def __init__(self, scheme, year, attribute):
         super().__init__(scheme, year, attribute)
@@ -110,7 +276,7 @@ class OfferPromotionReport(PromotionReport):
         return [
             candidate
             for candidate in super().eligible_candidates()
-            if getattr(candidate.applications[0], offer)
+            if getattr(candidate.application_history[0], offer)
         ]
 
 
@@ -0,0 +1,142 @@
+from collections import defaultdict
+from datetime import date
+
+import numpy as np
+from sqlalchemy import func
+
+from app.models import Application, Candidate, db
+from reporting.base_promotion_report import PromotionReport
+from reporting.promotion_reports import AllCharacteristicsPromotionReport
+
+
+class TimeToPromotionReport(PromotionReport):
+    """
+    How long each group in an intake took to be promoted: for substantive and temporary promotions, the number of
+    candidates promoted and the percentiles of the days from the scheme's start to their first promotion.
+
+    Promotions count from the same date as the other promotion reports. One from before the scheme started, between
+    the candidate finding out they were successful and starting, is counted as zero days. On Postgres the percentiles
+    are calculated by the database, with percentile_cont. Elsewhere each candidate's days are read and the percentiles
+    calculated with numpy, which interpolates between values in the same way
+    """
+
+    kinds = ("substantive", "temporary")
+    percentiles = (25, 50, 75)
+    percentile_titles = ("25th percentile", "median", "75th percentile")
+
+    def __init__(self, scheme: str, year: str, attribute: str):
+        super().__init__(scheme, year, attribute)
+        self.headers = ["characteristic"]
+        for kind in self.kinds:
+            self.headers.append(f"number {kind}ly promoted")
+            self.headers.extend(
+                f"{title} days to first {kind} promotion"
+                for title in self.percentile_titles
+            )
+        self.headers.append("total in group")
+        self.filename = (
+            f"time-to-promotion-by-{attribute}-{scheme}-{year}"
+            f"-generated-{date.today().strftime('%d-%m-%Y')}"
+        )
+
+    def percentile_query(self, group_by):
+        """
+        The promoted counts and percentiles for each value of `group_by`, calculated by the database. This needs
+        percentile_cont, which Postgres has and SQLite doesn't
+        """
+        first_promotions = self.first_promotions(self.kinds)
+        columns = [group_by]
+        for kind in self.kinds:
+            days = func.greatest(
+                first_promotions.c[kind] - Application.scheme_start_date, 0
+            )
+            columns.append(func.count(days))
+            columns.extend(
+                func.percentile_cont(percentile / 100).within_group(days)
+                for percentile in self.percentiles
+            )
+        columns.append(func.count(Application.id))
+        return (
+            self.cohort_query(*columns)
+            .outerjoin(
+                first_promotions, first_promotions.c.candidate_id == Candidate.id
+            )
+            .group_by(group_by)
+        )
+
+    def distributions_in_sql(self, group_by):
+        return {row[0]: list(row[1:]) for row in self.percentile_query(group_by)}
+
+    def distributions_in_memory(self, group_by):
+        """
+        The same numbers as `distributions_in_sql`, from each eligible candidate's scheme start and first promotion
+        dates
+        """
+        first_promotions = self.first_promotions(self.kinds)
+        rows = (
+            self.cohort_query(
+                group_by,
+                Application.scheme_start_date,
+                *[first_promotions.c[kind] for kind in self.kinds],
+            )
+            .outerjoin(
+                first_promotions, first_promotions.c.candidate_id == Candidate.id
+            )
+            .all()
+        )
+        positions = defaultdict(list)
+        for position, row in enumerate(rows):
+            positions[row[0]].append(position)
+
+        starts = np.array([row[1] for row in rows], dtype="datetime64[D]")
+        days = {}
+        for index, kind in enumerate(self.kinds, start=2):
+            firsts = np.array([row[index] for row in rows], dtype="datetime64[D]")
+            days[kind] = np.where(
+                np.isnat(firsts),
+                np.nan,
+                np.maximum((firsts - starts).astype("f8"), 0),
+            )
+
+        distributions = {}
+        for value, group in positions.items():
+            distribution = []
+            for kind in self.kinds:
+                promoted = days[kind][group]
+                promoted = promoted[~np.isnan(promoted)]
+                distribution.append(len(promoted))
+                if len(promoted):
+                    distribution.extend(
+                        np.percentile(promoted, self.percentiles).tolist()
+                    )
+                else:
+                    distribution.extend([None] * len(self.percentiles))
+            distribution.append(len(group))
+            distributions[value] = distribution
+        return distributions
+
+    def get_data(self):
+        group_by = AllCharacteristicsPromotionReport.grouping_column(self.attribute)
+        if db.engine.dialect.name == "postgresql":
+            distributions = self.distributions_in_sql(group_by)
+        else:
+            distributions = self.distributions_in_memory(group_by)
+        empty = ([0] + [None] * len(self.percentiles)) * len(self.kinds) + [0]
+        return [
+            [title, *distributions.get(value, empty)]
+            for value, title in AllCharacteristicsPromotionReport.row_titles(
+                self.attribute
+            )
+        ]
+
+    def write_row(self, row_data, data_object, csv_writer):
+        """
+        Percentiles are written to one decimal place, and left blank for a group where nobody was promoted
+        """
+        csv_writer.writerow(
+            [
+                round(value, 1) if isinstance(value, float) else value
+                for value in row_data
+            ]
+        )
+        return data_object.getvalue()
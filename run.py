@@ -1,11 +1,31 @@
 from app import create_app
-from app.models import Role, User, Candidate, Organisation, db
+from app import search
+from app.engines import engine_profiles
+from app.models import Role, User, Candidate, Organisation, CandidatePromotionSummary, db
 import click
+import sys
+from functools import wraps
 from modules.seed import commit_data
+from reporting.jobs import report_jobs
+
+MAINTENANCE = 'maintenance'
 
 app = create_app()
 
 
+def maintenance(command):
+    """
+    Run `command` through the maintenance engine profile, so that its whole-table statements aren't cancelled by the
+    statement timeout web requests have
+    """
+    @wraps(command)
+    def run_without_timeout(*args, **kwargs):
+        with engine_profiles.workload(MAINTENANCE):
+            return command(*args, **kwargs)
+
+    return run_without_timeout
+
+
 @app.shell_context_processor
 def make_shell_context():
     return {'db': db, 'User': User, 'Role': Role, 'Candidate': Candidate, 'Organisation': Organisation}
@@ -13,6 +33,7 @@ def make_shell_context():
 
 @app.cli.command()
 @click.option('--new-install', default=False, help='Build the database and seed it with data')
+@maintenance
 def seed(new_install):
     """
     If you pass it 'new install' it'll build the database for you. Otherwise it'll just seed it with data
@@ -20,3 +41,52 @@ def seed(new_install):
     if new_install:
         db.create_all()
     commit_data()
+
+
+@app.cli.command("report-worker")
+@click.option('--poll-interval', default=2.0, help='Seconds to wait between checks for new report jobs')
+def report_worker(poll_interval):
+    """
+    Build queued reports, one after another. Use this with REPORT_JOB_EXECUTOR set to 'worker'
+    """
+    report_jobs.work(poll_interval)
+
+
+@app.cli.command("rebuild-promotion-summaries")
+@maintenance
+def rebuild_promotion_summaries():
+    """
+    Recalculate every candidate's promotion summary from their roles. Run this after changing roles outside the app
+    """
+    CandidatePromotionSummary.refresh(db.session.connection())
+    db.session.commit()
+
+
+@app.cli.command("rebuild-search-index")
+@maintenance
+def rebuild_search_index():
+    """
+    Rewrite every candidate's row in the search index. Run this after changing candidates or applications outside the app
+    """
+    search.refresh(db.session.connection())
+    db.session.commit()
+
+
+@app.cli.command("check-current-pointers")
+@click.option('--repair', is_flag=True, help='Re-point the candidates found at their latest role and application')
+@maintenance
+def check_current_pointers(repair):
+    """
+    List candidates whose current role or application pointer is out of date, for example after roles or
+    applications were changed outside the app
+    """
+    stale = Candidate.stale_current_pointers(db.session.connection())
+    for candidate_id in stale:
+        click.echo(f'Candidate {candidate_id} has out of date current pointers')
+    click.echo(f'{len(stale)} candidates with out of date current pointers')
+    if stale and repair:
+        Candidate.refresh_current(db.session.connection(), stale)
+        db.session.commit()
+        click.echo(f'Repaired {len(stale)} candidates')
+    elif stale:
+        sys.exit(1)
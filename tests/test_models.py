@@ -6,7 +6,14 @@ from app.models import (
     Grade,
     Application,
     Promotion,
+    CandidatePromotionSummary,
+    Organisation,
 )
+from app.loading import loader_profile
+from app.instrumentation import assert_max_queries
+from app.lookups import lookups
+from app.timelines import CareerTimeline
+from app import search
 from datetime import date
 import pytest
 
@@ -147,6 +154,95 @@ class TestCandidate:
             == test_candidate_applied_to_fls.most_recent_application().application_date
         )
 
+    def test_current_pointers_follow_roles_and_applications(self, test_session):
+        test_candidate = Candidate()
+        test_session.add(test_candidate)
+        test_candidate.roles.append(Role(date_started=date(2018, 1, 1), grade_id=1))
+        test_candidate.applications.append(
+            Application(application_date=date(2018, 6, 1))
+        )
+        test_session.commit()
+        first_role_id = test_candidate.current_role_id
+        assert Role.query.get(first_role_id).date_started == date(2018, 1, 1)
+
+        later_role = Role(date_started=date(2019, 1, 1), grade_id=2)
+        later_application = Application(application_date=date(2019, 6, 1))
+        test_candidate.roles.append(later_role)
+        test_candidate.applications.append(later_application)
+        test_session.commit()
+        assert test_candidate.current_role_id == later_role.id
+        assert test_candidate.current_application_id == later_application.id
+        assert test_candidate.current_grade().value == "Grade 7"
+
+        test_session.delete(later_role)
+        test_session.commit()
+        assert test_candidate.current_role_id == first_role_id
+
+    def test_current_state_for_many_candidates(self, test_session):
+        with_history, without_history = Candidate(), Candidate()
+        with_history.roles.extend(
+            [
+                Role(date_started=date(2019, 1, 1), grade_id=2, role_name="Latest"),
+                Role(date_started=date(2018, 1, 1), grade_id=1, role_name="First"),
+            ]
+        )
+        with_history.applications.extend(
+            [
+                Application(application_date=date(2018, 6, 1), cohort=1),
+                Application(application_date=date(2019, 6, 1), cohort=2),
+            ]
+        )
+        test_session.add_all([with_history, without_history])
+        test_session.commit()
+        ids = [with_history.id, without_history.id]
+
+        with assert_max_queries(1):
+            states = Candidate.current_state_for(ids)
+            assert states[ids[0]].role.role_name == "Latest"
+            assert states[ids[0]].role.grade.value == "Grade 7"
+            assert states[ids[0]].application.cohort == 2
+        assert states[ids[1]] == (None, None, None, None, None)
+
+    def test_role_changes_since_date(self, test_session):
+        first, second = Candidate(), Candidate()
+        first.roles.extend(
+            [
+                Role(date_started=date(2017, 1, 1), role_change_id=4),
+                Role(date_started=date(2019, 1, 1), role_change_id=1),
+                Role(date_started=date(2019, 6, 1), role_change_id=3),
+            ]
+        )
+        second.roles.append(Role(date_started=date(2018, 1, 1), role_change_id=2))
+        test_session.add_all([first, second])
+        test_session.commit()
+
+        assert [
+            role.role_change_id for role in first.roles_since_date(date(2019, 1, 1))
+        ] == [3, 1]
+        assert Candidate.role_change_types_since(
+            [first.id, second.id], date(2018, 6, 1)
+        ) == {first.id: {1, 3}}
+        assert [
+            candidate.id
+            for candidate in Candidate.query.filter(
+                Candidate.had_role_change_since(2, date(2018, 1, 1))
+            )
+        ] == [second.id]
+
+    def test_stale_current_pointers_are_found_and_repaired(
+        self, test_candidate_applied_to_fls, test_session
+    ):
+        connection = test_session.connection()
+        assert Candidate.stale_current_pointers(connection) == []
+        connection.execute(
+            Candidate.__table__.update().values(current_application_id=None)
+        )
+        assert Candidate.stale_current_pointers(connection) == [
+            test_candidate_applied_to_fls.id
+        ]
+        Candidate.refresh_current(connection, [test_candidate_applied_to_fls.id])
+        assert Candidate.stale_current_pointers(connection) == []
+
 
 class TestGrade:
     def test_eligible_returns_correct_grades(self, test_session):
@@ -205,3 +301,257 @@ class TestRole:
             ]
         )
         assert test_candidate.roles[0].is_promotion() is expected_outcome
+
+
+class TestCareerTimeline:
+    def test_transitions_across_careers(self, test_session):
+        first, second = Candidate(), Candidate()
+        first.roles.extend(
+            [
+                Role(date_started=date(2018, 1, 1), grade_id=1),
+                Role(date_started=date(2019, 1, 1), grade_id=2, role_change_id=1),
+                Role(date_started=date(2019, 7, 1), grade_id=2, role_change_id=3),
+            ]
+        )
+        second.roles.extend(
+            [
+                Role(date_started=date(2018, 1, 1), grade_id=3),
+                Role(date_started=date(2018, 3, 1), grade_id=2, role_change_id=4),
+            ]
+        )
+        test_session.add_all([first, second])
+        test_session.commit()
+        ids = [first.id, second.id]
+
+        with assert_max_queries(1):
+            timeline = CareerTimeline.for_candidates(ids)
+        transitions = timeline.transitions
+        assert list(transitions["candidate_id"]) == [ids[0], ids[0], ids[1]]
+        assert list(transitions["rank_delta"]) == [1, 0, -1]
+        assert list(transitions["role_change_id"]) == [1, 3, 4]
+        assert list(transitions["duration"].astype(int)) == [365, 181, 59]
+        assert list(timeline.promotions()["candidate_id"]) == [ids[0]]
+
+    def test_is_promotion_compares_with_the_role_before(self, test_session):
+        candidate = Candidate()
+        promotion = Role(date_started=date(2019, 1, 1), grade_id=2, role_change_id=1)
+        candidate.roles.extend(
+            [
+                Role(date_started=date(2018, 1, 1), grade_id=1),
+                promotion,
+                Role(date_started=date(2020, 1, 1), grade_id=2, role_change_id=3),
+            ]
+        )
+        test_session.add(candidate)
+        test_session.commit()
+        assert promotion.is_promotion() is True
+        assert candidate.roles[-1].is_promotion() is False
+
+
+class TestLoaderProfiles:
+    def test_listing_loads_roles_up_front(self, test_session):
+        organisation = Organisation(name="Department of Loading")
+        for number in range(3):
+            candidate = Candidate(email_address=f"listing.{number}@gov.uk")
+            candidate.roles.extend(
+                [
+                    Role(date_started=date(2018, 1, 1), organisation=organisation),
+                    Role(date_started=date(2019, 1, 1), organisation=organisation),
+                ]
+            )
+            test_session.add(candidate)
+        test_session.commit()
+
+        with assert_max_queries(2):
+            candidates = Candidate.query.options(*loader_profile("listing")).all()
+            organisations = {
+                role.organisation.name
+                for candidate in candidates
+                for role in candidate.role_history
+            }
+        assert organisations == {"Department of Loading"}
+
+    def test_unknown_profile(self):
+        with pytest.raises(ValueError):
+            loader_profile("everything")
+
+
+class TestLookups:
+    def test_tables_are_loaded_once(self, test_session):
+        lookups.table(Promotion)
+        with assert_max_queries(0):
+            promotions = lookups.table(Promotion)
+            assert "level transfer" == promotions.get(3).value
+            assert 3 == promotions.find("level transfer").id
+            assert 2 == promotions.containing("temporary").id
+
+    def test_rows_are_immutable(self, test_session):
+        with pytest.raises(AttributeError):
+            lookups.table(Promotion).get(1).value = "promotion"
+
+    def test_writes_invalidate_tables(self, test_session):
+        assert lookups.table(Promotion).find("secondment") is None
+        test_session.add(Promotion(id=5, value="secondment"))
+        test_session.commit()
+        assert 5 == lookups.table(Promotion).find("secondment").id
+
+        Promotion.query.filter_by(id=5).delete()
+        test_session.commit()
+        assert lookups.table(Promotion).get(5) is None
+
+
+class TestCandidatePromotionSummary:
+    def summary(self, candidate_id):
+        return CandidatePromotionSummary.query.get(candidate_id)
+
+    def test_summary_follows_new_roles(self, test_session):
+        test_candidate = Candidate()
+        test_session.add(test_candidate)
+        test_candidate.roles.append(
+            Role(date_started=date(2018, 1, 1), role_change_id=3, grade_id=1)
+        )
+        test_session.commit()
+        summary = self.summary(test_candidate.id)
+        assert summary.first_substantive_promotion is None
+        assert summary.current_grade_rank == 7
+
+        test_candidate.roles.extend(
+            [
+                Role(date_started=date(2019, 6, 1), role_change_id=1, grade_id=2),
+                Role(date_started=date(2019, 1, 1), role_change_id=2, grade_id=3),
+                Role(date_started=date(2018, 6, 1), role_change_id=1, grade_id=2),
+            ]
+        )
+        test_session.commit()
+        summary = self.summary(test_candidate.id)
+        assert summary.first_substantive_promotion == date(2018, 6, 1)
+        assert summary.last_substantive_promotion == date(2019, 6, 1)
+        assert summary.first_temporary_promotion == date(2019, 1, 1)
+        assert summary.current_grade_rank == 6
+        assert Role.query.get(summary.latest_role_id).date_started == date(2019, 6, 1)
+
+        rows = CandidatePromotionSummary.query.all()
+        CandidatePromotionSummary.refresh(test_session.connection())
+        assert [
+            (row.first_substantive_promotion, row.latest_role_id) for row in rows
+        ] == [
+            (row.first_substantive_promotion, row.latest_role_id)
+            for row in CandidatePromotionSummary.query.all()
+        ]
+
+    @pytest.mark.parametrize(
+        "promotion_dates, expected",
+        [
+            ([date(2017, 1, 1), date(2021, 1, 1)], False),
+            ([date(2017, 1, 1), date(2019, 1, 1), date(2021, 1, 1)], True),
+            ([date(2019, 1, 1)], True),
+            ([date(2017, 1, 1)], False),
+            ([], False),
+        ],
+    )
+    def test_promoted_between_matches_promoted(
+        self, promotion_dates, expected, test_session
+    ):
+        test_candidate = Candidate.query.get(1)
+        test_candidate.roles.append(Role(date_started=date(2016, 1, 1)))
+        test_candidate.roles.extend(
+            Role(date_started=promotion_date, role_change_id=1)
+            for promotion_date in promotion_dates
+        )
+        test_session.commit()
+        after, before = date(2018, 1, 1), date(2020, 1, 1)
+        promoted = (
+            Candidate.query.join(CandidatePromotionSummary)
+            .filter(CandidatePromotionSummary.promoted_between(after, before))
+            .count()
+        )
+        assert bool(promoted) is expected
+        assert test_candidate.promoted(after, before) is expected
+
+
+class TestApplication:
+    def test_intake_year_follows_scheme_start_date(self, test_session):
+        application = Application(candidate_id=1, scheme_start_date=date(2019, 3, 1))
+        test_session.add(application)
+        test_session.commit()
+        assert application.intake_year == 2019
+
+        application.defer(date(2020, 3, 1))
+        test_session.commit()
+        assert Application.query.filter_by(intake_year=2020).one() is application
+
+    def test_bulk_updates_keep_intake_year_in_step(self, test_session):
+        test_session.add(
+            Application(candidate_id=1, scheme_start_date=date(2019, 3, 1))
+        )
+        test_session.commit()
+        Application.query.update(
+            {Application.scheme_start_date: date(2021, 3, 1)},
+            synchronize_session=False,
+        )
+        test_session.commit()
+        assert Application.query.filter_by(intake_year=2021).count() == 1
+        Application.query.update({"scheme_start_date": None}, synchronize_session=False)
+        test_session.commit()
+        assert (
+            Application.query.filter(Application.intake_year.isnot(None)).count() == 0
+        )
+
+
+class TestCandidateSearch:
+    @pytest.fixture
+    def candidates(self, test_session):
+        test_session.add_all(
+            [
+                Candidate(
+                    id=2,
+                    first_name="Jonathan",
+                    last_name="Smith",
+                    email_address="jon.smith@gov.uk",
+                    applications=[Application(per_id=123456, employee_number="E991")],
+                ),
+                Candidate(
+                    id=3, first_name="Ann", last_name="Jonas", email_address="a@gov.uk"
+                ),
+                Candidate(
+                    id=4,
+                    first_name="Mary",
+                    last_name="Blacksmith",
+                    email_address="mary@gov.uk",
+                ),
+            ]
+        )
+        test_session.commit()
+
+    @staticmethod
+    def found(query):
+        return [result.candidate_id for result in search.search(query)]
+
+    def test_finds_name_email_and_identifiers(self, candidates):
+        assert [2] == self.found("jonathan sm")
+        assert [2] == self.found("jon.smith@")
+        assert [2] == self.found("e991")
+        assert [2] == self.found("2345")
+
+    def test_word_starts_come_first(self, candidates):
+        assert [2, 4] == self.found("smith")
+
+    def test_finds_misspellings_when_nothing_matches(self, candidates):
+        assert [2] == self.found("jonathon")
+        assert [] == self.found("zzzz")
+
+    def test_short_searches_find_nothing(self, candidates):
+        assert [] == self.found("jo")
+
+    def test_index_follows_changes(self, test_session, candidates):
+        candidate = Candidate.query.get(3)
+        candidate.last_name = "Jones"
+        candidate.applications.append(Application(employee_number="E777"))
+        test_session.commit()
+        assert [3] == self.found("ann jones")
+        assert [3] == self.found("E777")
+
+        test_session.delete(Application.query.filter_by(employee_number="E991").one())
+        test_session.commit()
+        assert [] == self.found("e991")
+        assert [2] == self.found("jonathan")
@@ -1,15 +1,38 @@
 import pytest
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import List
+from reporting import ReportFactory
 from reporting.promotion_reports import (
     CharacteristicPromotionReport,
     BooleanCharacteristicPromotionReport,
     DeltaOfferPromotionReport,
+    AllCharacteristicsPromotionReport,
+    CohortTrendReport,
 )
 from reporting.base_promotion_report import PromotionReport
 from reporting.detailed_report import DetailedReport
-from app.models import Ethnicity, Candidate, Application
+from reporting.time_to_promotion_report import TimeToPromotionReport
+from reporting.cache import report_cache, MemoryBackend, DiskBackend
+from reporting.jobs import (
+    JobStore,
+    report_jobs,
+    run_job,
+    QUEUED,
+    RUNNING,
+    COMPLETE,
+    FAILED,
+)
+from app.instrumentation import assert_max_queries
+from app.lookups import lookups
+from app.models import db, Ethnicity, Candidate, Application, Role, Promotion
+from benchmarks.dataset import generate
 from datetime import date
+from flask import current_app
 from freezegun import freeze_time
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
 
 
 class TestReports:
@@ -92,6 +115,64 @@ class TestReports:
         expected_output = ["Prefer not to say", 1, 1.0, 0, 0.0, 1]
         assert data[0] == expected_output
 
+    @freeze_time(date(2020, 1, 1))
+    def test_aggregate_rows_match_per_candidate_rows(
+        self,
+        test_ethnicities,
+        test_multiple_candidates_multiple_ethnicities,
+        candidates_promoter,
+        scheme_appender,
+        test_session,
+    ):
+        test_session.add(Ethnicity(id=4, value="Prefer not to say"))
+        black_british = Candidate.query.filter_by(ethnicity_id=3).all()
+        white_british = Candidate.query.filter_by(ethnicity_id=2).all()
+        candidates_promoter(black_british, 0.3, temporary=True)
+        candidates_promoter(white_british, 0.6)
+        scheme_appender(black_british + white_british)
+        test_session.commit()
+
+        report = CharacteristicPromotionReport("FLS", "2019", "ethnicity")
+        eligible = report.eligible_candidates()
+        expected_output = [
+            report.row_writer(
+                ethnicity.value,
+                [
+                    candidate
+                    for candidate in eligible
+                    if candidate.ethnicity == ethnicity
+                ],
+            )
+            for ethnicity in Ethnicity.query.all()
+        ]
+        assert report.get_data() == expected_output
+        assert ["Prefer not to say", 0, 0, 0, 0, 0] in expected_output
+
+    @freeze_time(date(2020, 1, 1))
+    def test_candidates_with_two_applications_are_counted_once(
+        self, test_candidate, test_session
+    ):
+        test_session.add(Ethnicity(id=1, value="Prefer not to say"))
+        for application_date in (date(2018, 6, 1), date(2018, 9, 1)):
+            test_candidate.applications.append(
+                Application(
+                    scheme_id=1,
+                    application_date=application_date,
+                    scheme_start_date=date(2019, 3, 1),
+                )
+            )
+        test_candidate.roles.append(
+            Role(date_started=date(2019, 6, 1), role_change_id=1)
+        )
+        test_session.commit()
+
+        report = CharacteristicPromotionReport("FLS", "2019", "ethnicity")
+        eligible = report.eligible_candidates()
+        assert len(eligible) == 1
+        row = report.row_writer("Prefer not to say", eligible)
+        assert row == ["Prefer not to say", 1, 1.0, 0, 0.0, 1]
+        assert row in report.get_data()
+
 
 class TestPromotionReport:
     def test_eligible_candidates(self, test_session, candidates_promoter):
@@ -158,6 +239,25 @@ class TestBooleanCharacteristicPromotionReport:
         ]
         assert output == expected_output
 
+    def test_only_the_intake_is_counted(
+        self, disability_with_without_no_answer, scheme_appender, test_session
+    ):
+        candidates = Candidate.query.order_by(Candidate.id).all()
+        scheme_appender(candidates[:12], scheme_id_to_add=1)
+        scheme_appender(candidates[12:20], scheme_id_to_add=2)
+        test_session.commit()
+
+        report = BooleanCharacteristicPromotionReport(
+            "FLS", "2019", "long_term_health_condition"
+        )
+        lookups.table(Promotion)
+        with assert_max_queries(1):
+            output = report.get_data()
+        assert [row[-1] for row in output] == [
+            len([c for c in candidates[:12] if c.long_term_health_condition is value])
+            for value in (True, False, None)
+        ]
+
 
 class TestDeltaOfferPromotionReport:
     def test_get_data(
@@ -190,6 +290,197 @@ class TestDeltaOfferPromotionReport:
         assert expected_output == output
 
 
+class TestAllCharacteristicsPromotionReport:
+    @freeze_time(date(2020, 1, 1))
+    def test_sections_match_single_characteristic_reports(
+        self,
+        test_ethnicities,
+        test_multiple_candidates_multiple_ethnicities,
+        candidates_promoter,
+        scheme_appender,
+        test_session,
+    ):
+        candidates = Candidate.query.filter(Candidate.ethnicity_id.isnot(None)).all()
+        for index, candidate in enumerate(candidates):
+            candidate.long_term_health_condition = [True, False, None][index % 3]
+        candidates_promoter(candidates[:10], 0.5, temporary=True)
+        candidates_promoter(candidates[10:], 0.3)
+        scheme_appender(candidates)
+        test_session.commit()
+
+        report = ReportFactory.create_report(
+            "promotions", scheme="FLS", year="2019", attribute="all"
+        )
+        assert isinstance(report, AllCharacteristicsPromotionReport)
+        output = report.get_data()
+
+        ethnicity_rows = output.index(("Ethnicity",)) + 2
+        assert output[ethnicity_rows:][:2] == (
+            CharacteristicPromotionReport("FLS", "2019", "ethnicity").get_data()
+        )
+        disability_rows = output.index(("Disability",)) + 2
+        eligible = report.eligible_candidates()
+        assert output[disability_rows:][:3] == [
+            report.row_writer(
+                title,
+                [
+                    candidate
+                    for candidate in eligible
+                    if candidate.long_term_health_condition is value
+                ],
+            )
+            for value, title in report.row_titles("long_term_health_condition")
+        ]
+        assert 8 == len([row for row in output if row == report.section_headers])
+
+    def test_csv_has_a_section_per_characteristic(self, test_session):
+        csv_output = AllCharacteristicsPromotionReport("FLS", "2019").to_csv()
+        lines = csv_output.splitlines()
+        assert lines[0] == "Promotions by characteristic for the FLS 2019 intake"
+        assert "Caring responsibility" in lines
+        assert "I have caring responsibilities,0,0%,0,0%,0" in lines
+
+
+class TestCohortTrendReport:
+    @freeze_time(date(2020, 1, 1))
+    def test_each_year_matches_its_single_year_report(
+        self,
+        test_ethnicities,
+        test_multiple_candidates_multiple_ethnicities,
+        candidates_promoter,
+        test_session,
+    ):
+        candidates = Candidate.query.order_by(Candidate.id).all()[1:]
+        for number, candidate in enumerate(candidates):
+            year = 2018 + number % 2
+            candidate.applications.append(
+                Application(
+                    scheme_id=1,
+                    application_date=date(year - 1, 6, 1),
+                    scheme_start_date=date(year, 3, 1),
+                )
+            )
+            if number % 3 == 0:
+                # too early to count for the 2019 intake, but not for 2018
+                candidate.roles.append(
+                    Role(date_started=date(2018, 6, 1), role_change_id=2)
+                )
+        candidates_promoter(candidates[::4], 1)
+        test_session.commit()
+
+        report = CohortTrendReport("FLS", "2018", "ethnicity", final_year="2019")
+        lookups.table(Promotion), lookups.table(Ethnicity)
+        with assert_max_queries(1):
+            data = report.get_data()
+        for index, year in enumerate(report.years):
+            single_year = CharacteristicPromotionReport("FLS", str(year), "ethnicity")
+            start = 1 + index * 5
+            assert [row[start:][:5] for row in data] == [
+                row[1:] for row in single_year.get_data()
+            ]
+        assert report.headers[1] == "2018 number substantively promoted"
+        assert len(report.headers) == 11
+
+    def test_final_year_cant_be_before_first(self, test_session):
+        with pytest.raises(ValueError):
+            CohortTrendReport("FLS", "2019", "gender", final_year="2018")
+
+    def test_rates_are_written_as_percentages(self, test_session):
+        report = ReportFactory.create_report(
+            "trends", scheme="FLS", year="2019", attribute="caring_responsibility"
+        )
+        lines = report.to_csv().splitlines()
+        assert lines[1] == "I have caring responsibilities,0,0%,0,0%,0"
+
+
+class TestTimeToPromotionReport:
+    @freeze_time(date(2020, 1, 1))
+    def test_percentiles_by_characteristic(self, test_ethnicities, test_session):
+        def candidate(ethnicity_id, *roles):
+            candidate = Candidate(ethnicity_id=ethnicity_id)
+            candidate.applications.append(
+                Application(scheme_id=1, scheme_start_date=date(2019, 3, 1))
+            )
+            candidate.roles.extend(
+                Role(date_started=started, role_change_id=role_change_id)
+                for started, role_change_id in roles
+            )
+            return candidate
+
+        test_session.add_all(
+            [
+                # only the first promotion since December 2018 counts
+                candidate(
+                    2,
+                    (date(2018, 6, 1), 1),
+                    (date(2019, 3, 11), 1),
+                    (date(2019, 6, 1), 1),
+                ),
+                candidate(2, (date(2019, 3, 31), 1)),
+                # promoted before the scheme started
+                candidate(2, (date(2019, 1, 1), 2)),
+                candidate(3, (date(2019, 6, 1), 3)),
+            ]
+        )
+        test_session.commit()
+
+        report = ReportFactory.create_report(
+            "time-to-promotion", scheme="FLS", year="2019", attribute="ethnicity"
+        )
+        assert report.get_data() == [
+            ["White British", 2, 15.0, 20.0, 25.0, 1, 0.0, 0.0, 0.0, 3],
+            ["Black British", 0, None, None, None, 0, None, None, None, 1],
+        ]
+        lines = report.to_csv().splitlines()
+        assert lines[0].startswith("characteristic,number substantively promoted,")
+        assert lines[2] == "Black British,0,,,,0,,,,1"
+
+    def test_postgres_calculates_percentiles(self, test_session):
+        report = TimeToPromotionReport("FLS", "2019", "gender")
+        statement = str(
+            report.percentile_query(Candidate.gender_id).statement.compile(
+                dialect=postgresql.dialect()
+            )
+        )
+        assert (
+            "percentile_cont(%(percentile_cont_1)s) WITHIN GROUP (ORDER BY" in statement
+        )
+
+
+class TestPromotionSurvivalReport:
+    @freeze_time(date(2019, 12, 31))
+    def test_kaplan_meier_estimates(self, test_ethnicities, test_session):
+        for ethnicity_id, promoted_on in [
+            (2, date(2019, 3, 11)),
+            (2, date(2019, 3, 11)),
+            (2, date(2019, 3, 31)),
+            (2, None),
+            (3, None),
+        ]:
+            candidate = Candidate(ethnicity_id=ethnicity_id)
+            candidate.applications.append(
+                Application(scheme_id=1, scheme_start_date=date(2019, 3, 1))
+            )
+            if promoted_on:
+                candidate.roles.append(Role(date_started=promoted_on, role_change_id=1))
+            test_session.add(candidate)
+        test_session.commit()
+
+        report = ReportFactory.create_report(
+            "survival", scheme="FLS", year="2019", attribute="ethnicity"
+        )
+        lookups.table(Promotion), lookups.table(Ethnicity)
+        with assert_max_queries(1):
+            data = report.get_data()
+        assert data == [
+            ["White British", 0, 4, 0, 1.0],
+            ["White British", 10, 4, 2, 0.5],
+            ["White British", 30, 2, 1, 0.25],
+            ["Black British", 0, 1, 0, 1.0],
+        ]
+        assert report.to_csv().splitlines()[3] == "White British,30,2,1,0.250"
+
+
 class TestDetailedPromotionReport:
     @pytest.mark.parametrize("intake_year", (2017, 2018, 2019))
     @pytest.mark.parametrize("role_change_type", (1, 2, 3))
@@ -225,3 +516,251 @@ class TestDetailedPromotionReport:
             ]
         else:
             assert report.get_data() == []
+
+    @freeze_time(date(2020, 3, 1))
+    def test_each_row_uses_that_candidates_latest_application_and_role(
+        self, detailed_candidate, test_session, monkeypatch
+    ):
+        for number in range(3):
+            candidate = Candidate(
+                first_name=f"Candidate {number}",
+                ethnicity_id=1,
+                gender_id=1,
+                sexuality_id=1,
+                age_range_id=1,
+                belief_id=1,
+                working_pattern_id=1,
+                main_job_type_id=1,
+                joining_grade_id=1,
+            )
+            candidate.applications.extend(
+                [
+                    Application(
+                        application_date=date(2017, 6, 1),
+                        scheme_start_date=date(2018, 3, 1),
+                        scheme_id=1,
+                        cohort=number,
+                    ),
+                    Application(
+                        application_date=date(2018, 6, 1),
+                        scheme_start_date=date(2019, 3, 1),
+                        scheme_id=1,
+                        cohort=number + 10,
+                    ),
+                ]
+            )
+            candidate.roles.extend(
+                [
+                    Role(
+                        date_started=date(2019, 1, 1 + number),
+                        role_change_id=1,
+                        role_name=f"Role {number}",
+                        grade_id=5,
+                        location_id=2,
+                        organisation_id=1,
+                    ),
+                    Role(date_started=date(2016, 1, 1), role_change_id=1),
+                ]
+            )
+            test_session.add(candidate)
+        test_session.commit()
+        monkeypatch.setattr(DetailedReport, "batch_size", 2)
+
+        # the scheme and role change lookups, the candidates, then one query for each of the two batches, whatever
+        # the batch size
+        with assert_max_queries(5):
+            rows = {row[0]: row for row in DetailedReport(2019, "FLS", 1).get_data()}
+        assert len(rows) == 4
+        assert rows["Testy Candidate"][2:5] == [1, "META", "Director of Happiness"]
+        for number in range(3):
+            assert rows[f"Candidate {number} None"][2] == number + 10
+            assert rows[f"Candidate {number} None"][4] == f"Role {number}"
+
+    @freeze_time(date(2020, 3, 1))
+    def test_rows_are_streamed(self, detailed_candidate, test_session, monkeypatch):
+        report = DetailedReport(2019, "FLS", 1)
+        csv_chunks = report.generate_report_data()
+
+        def fail():
+            pytest.fail("Rows were built before the header was sent")
+
+        monkeypatch.setattr(report, "candidates", fail)
+        assert next(csv_chunks).startswith("candidate name,candidate email")
+
+        monkeypatch.undo()
+        assert next(csv_chunks).startswith("Testy Candidate")
+
+
+class TestReportCache:
+    def test_memory_backend_evicts_least_recently_used(self):
+        backend = MemoryBackend(max_entries=2)
+        backend.set("first", 1)
+        backend.set("second", 2)
+        backend.get("first")
+        backend.set("third", 3)
+        assert [backend.get(key) for key in ("first", "second", "third")] == [
+            1,
+            None,
+            3,
+        ]
+
+    def test_entries_expire(self, tmp_path):
+        for backend in (MemoryBackend(ttl=60), DiskBackend(str(tmp_path), ttl=60)):
+            with freeze_time(date(2020, 1, 1)) as frozen_time:
+                backend.set("report", ["filename", "csv"])
+                assert backend.get("report") == ["filename", "csv"]
+                frozen_time.tick(61)
+                assert backend.get("report") is None
+
+    def test_disk_backend_is_shared_and_bounded(self, tmp_path):
+        writer = DiskBackend(str(tmp_path), max_entries=2)
+        reader = DiskBackend(str(tmp_path), max_entries=2)
+        for key in ("first", "second", "third"):
+            writer.set(key, key)
+        assert len(list(tmp_path.glob("*.json"))) == 2
+        assert reader.get("third") == "third"
+
+    def test_writing_report_data_invalidates_cache(
+        self, test_candidate, test_session, monkeypatch
+    ):
+        monkeypatch.setitem(current_app.extensions, "report_cache", MemoryBackend())
+        built = []
+
+        def create():
+            built.append(True)
+            return "filename", f"version {len(built)}"
+
+        parameters = {"scheme": "FLS", "year": "2019", "attribute": "ethnicity"}
+        assert report_cache.get_or_create("promotions", parameters, create)[1] == (
+            "version 1"
+        )
+        assert report_cache.get_or_create("promotions", parameters, create)[1] == (
+            "version 1"
+        )
+
+        test_candidate.roles.append(Role(date_started=date(2020, 1, 1)))
+        test_session.commit()
+        assert report_cache.get_or_create("promotions", parameters, create)[1] == (
+            "version 2"
+        )
+
+    def test_data_version_is_shared_by_every_process(
+        self, test_candidate, test_session, monkeypatch
+    ):
+        # each process with the simple backend has a cache of its own, but they all read one version
+        monkeypatch.setitem(current_app.extensions, "report_cache", MemoryBackend())
+        version = report_cache.data_version()
+        monkeypatch.setitem(current_app.extensions, "report_cache", MemoryBackend())
+        assert version == report_cache.data_version()
+
+        Application.query.filter(Application.candidate_id == test_candidate.id).update(
+            {"scheme_id": 2}
+        )
+        test_session.commit()
+        assert version != report_cache.data_version()
+
+
+class TestReportJobs:
+    def test_jobs_are_claimed_once_in_order(self, tmp_path):
+        store = JobStore(str(tmp_path))
+        first = store.enqueue("promotions", {"attribute": "ethnicity"})
+        second = store.enqueue("promotions", {"attribute": "gender"})
+        assert QUEUED == store.get(first.id).status
+        assert first.id == store.claim().id
+        assert store.claim(first.id) is None
+        assert second.id == store.claim().id
+        assert store.claim() is None
+
+    def test_worker_builds_queued_reports(self, tmp_path, test_session):
+        store = JobStore(str(tmp_path))
+        job = store.enqueue(
+            "promotions", {"scheme": "FLS", "year": "2019", "attribute": "gender"}
+        )
+        finished_job = run_job(store)
+        assert COMPLETE == finished_job.status
+        with open(store.output_path(job.id)) as report:
+            assert report.readline().startswith("characteristic,")
+
+    def test_failed_reports_are_recorded(self, tmp_path, test_session):
+        store = JobStore(str(tmp_path))
+        store.enqueue("promotions", {"attribute": "no-such-attribute"})
+        assert FAILED == run_job(store).status
+
+    def test_jobs_whose_worker_died_are_failed(self, tmp_path):
+        store = JobStore(str(tmp_path), timeout=60)
+        with freeze_time(date(2020, 1, 1)) as frozen_time:
+            abandoned = store.enqueue("promotions", {"attribute": "ethnicity"})
+            store.claim(abandoned.id)
+            frozen_time.tick(30)
+            assert RUNNING == store.get(abandoned.id).status
+            frozen_time.tick(31)
+            assert FAILED == store.get(abandoned.id).status
+
+            abandoned = store.enqueue("promotions", {"attribute": "gender"})
+            store.claim(abandoned.id)
+            frozen_time.tick(61)
+            store.claim()
+            # a store with no timeout sees the job as the claim left it
+            assert FAILED == JobStore(str(tmp_path)).get(abandoned.id).status
+
+    def test_jobs_lost_by_the_pool_are_failed(self, tmp_path, monkeypatch):
+        store = JobStore(str(tmp_path))
+        monkeypatch.setitem(current_app.extensions, "report_jobs", store)
+        job = store.enqueue("promotions", {"attribute": "ethnicity"})
+        store.claim(job.id)
+        app = current_app._get_current_object()
+        pool = ProcessPoolExecutor(max_workers=1)
+        monkeypatch.setattr(report_jobs, "_pools", {app: pool})
+        future = Future()
+        future.set_exception(BrokenProcessPool("A worker process died"))
+        report_jobs._job_done(app, pool, job.id, future)
+        assert FAILED == store.get(job.id).status
+        assert "A worker process died" in store.get(job.id).error
+        assert app not in report_jobs._pools
+
+    def test_jobs_that_cant_reach_the_pool_are_failed(self, tmp_path, monkeypatch):
+        store = JobStore(str(tmp_path))
+        monkeypatch.setitem(current_app.extensions, "report_jobs", store)
+        monkeypatch.setitem(current_app.config, "REPORT_JOB_EXECUTOR", "pool")
+
+        def broken_pool():
+            raise RuntimeError("Can't start a worker")
+
+        monkeypatch.setattr(report_jobs, "_pool", broken_pool)
+        job = report_jobs.submit("promotions", {"attribute": "ethnicity"})
+        assert FAILED == job.status
+        assert "Can't start a worker" in store.get(job.id).error
+
+    def test_finished_jobs_are_pruned(self, tmp_path, test_session):
+        store = JobStore(str(tmp_path))
+        job = store.enqueue("promotions", {"attribute": "no-such-attribute"})
+        run_job(store, job.id)
+        store.prune(older_than=-1)
+        assert store.get(job.id) is None
+
+
+class TestBenchmarkDataset:
+    @staticmethod
+    def generated_rows(size, seed):
+        engine = create_engine("sqlite://")
+        db.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        generate(session, size, seed)
+        rows = [
+            session.execute(table.select().order_by(table.c.id)).fetchall()
+            for table in (
+                Candidate.__table__,
+                Application.__table__,
+                Role.__table__,
+            )
+        ]
+        session.close()
+        return rows
+
+    def test_same_seed_generates_same_data(self):
+        candidates, applications, roles = self.generated_rows(50, seed=1)
+        assert len(candidates) == 50
+        assert len(applications) >= 50
+        assert len(roles) >= 50
+        assert self.generated_rows(50, seed=1) == [candidates, applications, roles]
+        assert self.generated_rows(50, seed=2) != [candidates, applications, roles]
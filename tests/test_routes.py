@@ -1,7 +1,18 @@
+import json
+import sqlite3
+import time
+from datetime import date
+
 import pytest
-from flask import url_for, session
+from flask import current_app, url_for, session
+from sqlalchemy.exc import OperationalError, TimeoutError
+from sqlalchemy.pool import QueuePool
 
 from app.models import (
+    db,
+    Application,
+    Candidate,
+    Ethnicity,
     Grade,
     Organisation,
     Profession,
@@ -9,9 +20,15 @@ from app.models import (
     Role,
     AuditEvent,
     Promotion,
+    Scheme,
 )
 from flask_login import current_user
 
+from app.engines import PoolMetrics, engine_options, engine_profiles, measured_pool
+from app.instrumentation import assert_max_queries
+from reporting.cache import MemoryBackend, report_cache
+from reporting.jobs import JobStore, report_jobs, run_job
+
 
 def test_home_status_code(test_client, logged_in_user):
     # sends HTTP GET request to the application
@@ -86,7 +103,9 @@ class TestRoleUpdate:
 class TestSearchCandidate:
     def test_get(self, test_client, logged_in_user):
         result = test_client.get("/update/search-candidate")
-        assert "Most recent candidate email address" in result.data.decode("UTF-8")
+        assert "Name, most recent email address, employee number or PER id" in (
+            result.data.decode("UTF-8")
+        )
 
     @pytest.mark.parametrize(
         "update_type, expected_title",
@@ -139,6 +158,40 @@ class TestSearchCandidate:
             == f"http://localhost{url_for('route_blueprint.search_candidate')}"
         )
 
+    def test_searching_by_name_lists_matches_to_choose_from(
+        self, test_client, test_candidate, logged_in_user, test_roles
+    ):
+        with test_client.session_transaction() as sess:
+            sess["bulk-single"] = "single"
+            sess["update-type"] = "name"
+        result = test_client.post(
+            "/update/search-candidate", data={"candidate-email": "testy cand"}
+        )
+        assert 'value="1"' in result.data.decode("UTF-8")
+
+        result = test_client.post(
+            "/update/search-candidate",
+            data={"candidate-email": "testy cand", "candidate-id": "1"},
+            follow_redirects=True,
+        )
+        assert "Update name" in result.data.decode("UTF-8")
+        assert 1 == session.get("candidate-id")
+
+    def test_typeahead(self, test_client, test_candidate, logged_in_user):
+        candidates = test_client.get("/candidates/search?q=Test").get_json()[
+            "candidates"
+        ]
+        assert [
+            {
+                "candidate_id": 1,
+                "name": "Testy Candidate",
+                "email_address": "test.candidate@numberten.gov.uk",
+                "identifiers": "",
+                "url": "/candidates/candidate/1",
+            }
+        ] == candidates
+        assert [] == test_client.get("/candidates/search?q=te").get_json()["candidates"]
+
 
 def test_check_details(
     logged_in_user,
@@ -219,6 +272,106 @@ class TestReports:
         result = test_client.post("/reports/detailed", data=data)
         assert 200 == result.status_code
 
+    def test_post_trend_report(self, test_client, logged_in_user):
+        data = {
+            "scheme": "FLS",
+            "year": "2017",
+            "final_year": "2020",
+            "attribute": "gender",
+        }
+        job = test_client.post(
+            "/reports/trends", data=data, headers={"Accept": "application/json"}
+        ).get_json()
+        assert "complete" == job["status"]
+        assert job["filename"].startswith("promotion-trends-by-gender-FLS-2017-2020")
+
+    def test_report_is_built_as_a_job(self, test_client, logged_in_user):
+        data = {
+            "report-type": "promotions",
+            "scheme": "FLS",
+            "year": 2018,
+            "attribute": "ethnicity",
+        }
+        job = test_client.post(
+            "/reports/", data=data, headers={"Accept": "application/json"}
+        ).get_json()
+        assert "complete" == job["status"]
+
+        status_page = test_client.get(f"/reports/jobs/{job['id']}")
+        assert "Download report" in status_page.data.decode("utf-8")
+
+        download = test_client.get(f"/reports/jobs/{job['id']}/download")
+        assert download.data.decode("utf-8").startswith("characteristic,")
+        assert f"filename={job['filename']}.csv" in download.headers.get(
+            "Content-Disposition"
+        )
+
+    def test_report_is_handed_to_the_job_pool(
+        self, test_client, logged_in_user, monkeypatch
+    ):
+        monkeypatch.setitem(current_app.config, "REPORT_JOB_EXECUTOR", "pool")
+        monkeypatch.setitem(current_app.config, "REPORT_JOB_WORKERS", 1)
+        data = {
+            "report-type": "promotions",
+            "scheme": "FLS",
+            "year": 2018,
+            "attribute": "ethnicity",
+        }
+        headers = {"Accept": "application/json"}
+        try:
+            result = test_client.post("/reports/", data=data, headers=headers)
+            assert 200 == result.status_code
+            job = result.get_json()
+            # the pool's process builds its own app before it runs anything
+            for _ in range(600):
+                job = test_client.get(
+                    f"/reports/jobs/{job['id']}", headers=headers
+                ).get_json()
+                if job["status"] in ("complete", "failed"):
+                    break
+                time.sleep(0.1)
+        finally:
+            report_jobs._pools.pop(current_app._get_current_object()).shutdown()
+        # the worker can't see this test's uncommitted data, so all that matters is that it ran the job
+        assert job["status"] in ("complete", "failed")
+        assert "pickle" not in (job["error"] or "")
+
+    def test_report_request_runs_a_bounded_number_of_queries(
+        self, test_client, logged_in_user
+    ):
+        data = {
+            "report-type": "promotions",
+            "scheme": "FLS",
+            "year": 2018,
+            "attribute": "ethnicity",
+        }
+        with assert_max_queries(8):
+            result = test_client.post("/reports/", data=data)
+        assert int(result.headers["X-Query-Count"]) <= 8
+        assert result.headers["Server-Timing"].startswith("db;dur=")
+
+    def test_request_queries_are_logged(self, test_client, caplog):
+        test_client.get("/auth/login")
+        logged = [
+            json.loads(record.getMessage())
+            for record in caplog.records
+            if record.name == f"{current_app.logger.name}.queries"
+        ]
+        assert "/auth/login" == logged[-1]["path"]
+
+    def test_failed_statements_leave_no_start_time_behind(self, test_session):
+        connection = test_session.connection()
+        with assert_max_queries(2) as stats:
+            with pytest.raises(OperationalError):
+                connection.execute("SELECT * FROM no_such_table")
+            connection.execute("SELECT 1")
+        assert stats.count == 1
+        assert not connection.info.get("query_start_time")
+
+    def test_unknown_job(self, test_client, logged_in_user):
+        assert 404 == test_client.get("/reports/jobs/no-such-job").status_code
+        assert 404 == test_client.get("/reports/jobs/no-such-job/download").status_code
+
 
 class TestProfile:
     def test_get(self, test_client, logged_in_user, test_candidate_applied_to_fls):
@@ -226,6 +379,273 @@ class TestProfile:
         assert "Career profile for Testy Candidate" in result.data.decode("utf-8")
 
 
+class TestResults:
+    @pytest.fixture
+    def candidates(self, test_session):
+        organisation = Organisation(name="Cabinet Office")
+        for candidate_id in range(2, 6):
+            candidate = Candidate(
+                id=candidate_id, email_address=f"candidate{candidate_id}@gov.uk"
+            )
+            candidate.roles.append(
+                Role(
+                    date_started=date(2019, 1, candidate_id), organisation=organisation
+                )
+            )
+            test_session.add(candidate)
+        test_session.commit()
+
+    @staticmethod
+    def get_page(test_client, url):
+        response = test_client.get(url, headers={"Accept": "application/json"})
+        assert 200 == response.status_code
+        return response
+
+    def test_pages_follow_on(self, test_client, logged_in_user, candidates):
+        page = self.get_page(test_client, "/results?page-size=2").get_json()
+        assert [1, 2] == [candidate["id"] for candidate in page["candidates"]]
+        assert page["previous"] is None
+
+        page = self.get_page(test_client, page["next"]).get_json()
+        assert [3, 4] == [candidate["id"] for candidate in page["candidates"]]
+        assert {
+            "id": page["candidates"][0]["roles"][0]["id"],
+            "date_started": "2019-01-03",
+            "organisation": "Cabinet Office",
+        } == page["candidates"][0]["roles"][0]
+
+        last_page = self.get_page(test_client, page["next"]).get_json()
+        assert [5] == [candidate["id"] for candidate in last_page["candidates"]]
+        assert last_page["next"] is None
+
+        page = self.get_page(test_client, last_page["previous"]).get_json()
+        assert [3, 4] == [candidate["id"] for candidate in page["candidates"]]
+
+    def test_query_count_does_not_depend_on_page_size(
+        self, test_client, logged_in_user, candidates
+    ):
+        # the first request after logging in also loads the user
+        self.get_page(test_client, "/results")
+        small_page = self.get_page(test_client, "/results?page-size=1")
+        large_page = self.get_page(test_client, "/results?page-size=5")
+        assert 5 == len(large_page.get_json()["candidates"])
+        assert (
+            small_page.headers["X-Query-Count"] == large_page.headers["X-Query-Count"]
+        )
+
+    def test_html_links_to_the_next_page(self, test_client, logged_in_user, candidates):
+        result = test_client.get("/results?page-size=2").data.decode("utf-8")
+        assert "candidate2@gov.uk" in result
+        assert "candidate3@gov.uk" not in result
+        assert "/results?after=2&amp;page-size=2" in result
+
+
+class TestReplicaRouting:
+    @pytest.fixture
+    def replica(self, tmp_path, monkeypatch, test_client, test_session):
+        monkeypatch.setitem(
+            current_app.config,
+            "SQLALCHEMY_BINDS",
+            {"replica": f"sqlite:///{tmp_path / 'replica-database'}"},
+        )
+        engine = db.get_engine(current_app, bind="replica")
+        db.Model.metadata.create_all(engine)
+        engine.execute(
+            Candidate.__table__.insert(), id=1, email_address="replica@gov.uk"
+        )
+        # earlier tests' updates may have pinned the test client to the primary
+        with test_client.session_transaction() as user_session:
+            user_session.pop("primary_reads_until", None)
+        yield
+        engine.dispose()
+
+    def test_read_only_pages_use_the_replica(
+        self, test_client, logged_in_user, replica
+    ):
+        assert "replica@gov.uk" in test_client.get("/results").data.decode("utf-8")
+        # the update wizard reads from the primary
+        with test_client.session_transaction() as user_session:
+            user_session["candidate-id"] = 1
+        assert test_client.get("/update/name").status_code == 200
+        assert Candidate.query.get(1).email_address is None
+
+    def test_users_read_their_own_writes(self, test_client, logged_in_user, replica):
+        with test_client.session_transaction() as user_session:
+            user_session["candidate-id"] = 1
+            user_session["data-update"] = {}
+            user_session["new-name"] = {"first-name": "Primary", "last-name": "Only"}
+        test_client.post("/update/check-your-answers")
+
+        results = test_client.get("/results").data.decode("utf-8")
+        assert "replica@gov.uk" not in results
+        with test_client.session_transaction() as user_session:
+            user_session["primary_reads_until"] = 0
+        results = test_client.get("/results").data.decode("utf-8")
+        assert "replica@gov.uk" in results
+
+    def test_report_jobs_read_their_users_writes(
+        self, test_client, logged_in_user, replica, test_session, monkeypatch, tmp_path
+    ):
+        monkeypatch.setitem(current_app.config, "REPORT_JOB_EXECUTOR", "worker")
+        monkeypatch.setitem(
+            current_app.extensions, "report_jobs", JobStore(str(tmp_path / "jobs"))
+        )
+        monkeypatch.setitem(current_app.extensions, "report_cache", MemoryBackend())
+        # the replica has the reference data, but hasn't yet caught up with the change below
+        replica_engine = db.get_engine(current_app, bind="replica")
+        replica_engine.execute(Scheme.__table__.insert(), id=1, name="FLS")
+        replica_engine.execute(
+            Ethnicity.__table__.insert(), id=1, value="Prefer not to say"
+        )
+        test_session.add(Ethnicity(id=1, value="Prefer not to say"))
+        candidate = Candidate.query.get(1)
+        candidate.ethnicity_id = 1
+        candidate.applications.append(
+            Application(scheme_id=1, scheme_start_date=date(2019, 3, 1))
+        )
+        test_session.commit()
+        # the user who made the change asks for a report, which a worker builds away from their request
+        with test_client.session_transaction() as user_session:
+            user_session["primary_reads_until"] = time.time() + 10
+        data = {
+            "report-type": "promotions",
+            "scheme": "FLS",
+            "year": 2019,
+            "attribute": "ethnicity",
+        }
+        job_id = test_client.post(
+            "/reports/", data=data, headers={"Accept": "application/json"}
+        ).get_json()["id"]
+        # the worker has no request, so it can't see the user's session
+        session.pop("primary_reads_until", None)
+        job = run_job(report_jobs.store, job_id)
+
+        with open(report_jobs.store.output_path(job.id)) as report:
+            assert "Prefer not to say,0,0%,0,0%,1" in report.read()
+        _, cached = report_cache.backend.get(
+            report_cache.key("promotions", job.parameters)
+        )
+        assert "Prefer not to say,0,0%,0,0%,1" in cached
+
+
+class TestEngineProfiles:
+    @pytest.fixture
+    def reporting_profile(self, monkeypatch):
+        profiles = {
+            **current_app.config["SQLALCHEMY_ENGINE_PROFILES"],
+            "reporting": {"statement_timeout": 0.05},
+        }
+        monkeypatch.setitem(current_app.config, "SQLALCHEMY_ENGINE_PROFILES", profiles)
+        monkeypatch.setitem(current_app.config, "SQLALCHEMY_ENGINE_OPTIONS", {})
+        monkeypatch.setitem(current_app.extensions, "engine_profiles", None)
+        engine_profiles.init_app(current_app)
+        yield
+        engine_profiles.engine(current_app, "reporting").dispose()
+
+    def test_reports_read_through_their_own_engine(self, reporting_profile):
+        reporting_engine = engine_profiles.engine(current_app, "reporting")
+        assert db.session.get_bind() is not reporting_engine
+        with engine_profiles.workload("reporting"):
+            assert db.session.get_bind() is reporting_engine
+        assert db.session.get_bind() is not reporting_engine
+
+    def test_writes_use_the_profiles_engine_on_the_primary(self, reporting_profile):
+        # maintenance commands write through their own profile, to escape the interactive statement timeout
+        reporting_engine = engine_profiles.engine(current_app, "reporting")
+        with engine_profiles.workload("reporting"):
+            db.session.info["written"] = True
+            assert db.session.get_bind() is reporting_engine
+            db.session.info.pop("written")
+
+    def test_overrunning_statements_are_cancelled(self, reporting_profile):
+        engine = engine_profiles.engine(current_app, "reporting")
+        endless = (
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+            "SELECT count(*) FROM n"
+        )
+        with pytest.raises(OperationalError, match="interrupted"):
+            engine.execute(endless)
+        # the next statement gets the full timeout again
+        assert engine.execute("SELECT 1").scalar() == 1
+
+    def test_streamed_results_are_cancelled_while_fetching(self, reporting_profile):
+        engine = engine_profiles.engine(current_app, "reporting")
+        endless = (
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+            "SELECT i FROM n"
+        )
+        give_up = time.monotonic() + 5
+        with engine.connect() as connection:
+            rows = connection.execution_options(stream_results=True).execute(endless)
+            with pytest.raises(OperationalError, match="interrupted"):
+                for _ in rows:
+                    assert time.monotonic() < give_up
+            # once the transaction is over, the clock is stopped
+            with connection.begin():
+                connection.execute("SELECT 1")
+                time.sleep(0.1)
+            assert not connection.connection.info["statement_deadline"][0]
+
+    def test_pool_options_follow_the_profile(self):
+        options = engine_options(
+            "postgresql://localhost/talent-tracker",
+            {
+                "pool_size": 3,
+                "max_overflow": 2,
+                "pool_timeout": 5,
+                "pool_recycle": 60,
+                "pool_pre_ping": True,
+                "statement_timeout": 1.5,
+            },
+            PoolMetrics(capacity=5),
+        )
+        assert issubclass(options.pop("poolclass"), QueuePool)
+        assert {
+            "pool_size": 3,
+            "max_overflow": 2,
+            "pool_timeout": 5,
+            "pool_recycle": 60,
+            "pool_pre_ping": True,
+            "connect_args": {"options": "-c statement_timeout=1500"},
+        } == options
+
+    def test_heroku_database_urls_get_the_statement_timeout(self):
+        options = engine_options(
+            "postgres://localhost/talent-tracker",
+            {"statement_timeout": 1.5},
+            PoolMetrics(capacity=15),
+        )
+        assert {"options": "-c statement_timeout=1500"} == options["connect_args"]
+
+    def test_checkout_waits_and_utilisation_are_measured(self, tmp_path):
+        metrics = PoolMetrics(capacity=1)
+        pool_class = measured_pool(QueuePool, {}, metrics)
+        pool = pool_class(
+            lambda: sqlite3.connect(str(tmp_path / "pool-database")),
+            pool_size=1,
+            max_overflow=0,
+            timeout=0.01,
+        )
+        connection = pool.connect()
+        assert 1.0 == metrics.as_dict()["utilisation"]
+        with pytest.raises(TimeoutError):
+            pool.connect()
+        connection.close()
+
+        measured = metrics.as_dict()
+        assert 1 == measured["checkouts"]
+        assert 0 == measured["checked_out"]
+        assert 1 == measured["timeouts"]
+        assert measured["max_wait_ms"] >= 10
+
+    def test_metrics_endpoint(self, test_client, logged_in_user, reporting_profile):
+        engine_profiles.engine(current_app, "reporting").execute("SELECT 1")
+        metrics = test_client.get("/metrics/database-pools").get_json()
+        assert {"interactive", "reporting"} == set(metrics)
+        assert 1 == metrics["reporting"]["checkouts"]
+        assert 0 == metrics["reporting"]["checked_out"]
+
+
 def test_audit_events(test_client, logged_in_user):
     data = {
         "report-type": "promotions",